@@ -0,0 +1,56 @@
+from datetime import date, timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from .models import DailyActivity, Feed
+
+# 히트맵 기간(일). 하루 단위로 최대 366 행
+HEATMAP_DAYS = 366
+BUCKETS = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+def record_feed_activity(user_id, day, delta):
+    # 해당 날짜 행을 F() 로 증감하고, 없으면 만든다 (동시에 만들면 다시 증감)
+    updated = DailyActivity.objects.filter(user_id=user_id, day=day).update(feed_count=F('feed_count') + delta)
+    if updated or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            DailyActivity.objects.create(user_id=user_id, day=day, feed_count=delta)
+    except IntegrityError:
+        DailyActivity.objects.filter(user_id=user_id, day=day).update(feed_count=F('feed_count') + delta)
+
+def remove_feeds_activity(feeds):
+    # 함께 지워질 피드(queryset)를 유저 / 날짜별로 묶어서 활동 수를 뺀다 (삭제 전에 같은 트랜잭션에서 호출)
+    counts = feeds.annotate(day=TruncDate('created_at')).values('user_id', 'day').annotate(count=Count('id')).order_by()
+    for row in counts:
+        record_feed_activity(row['user_id'], row['day'], -row['count'])
+
+def activity_heatmap(user_id, end=None, bucket='day'):
+    """
+    end 까지 HEATMAP_DAYS 일 동안의 활동 수. week / month 는 DB 에서 묶어서 합계를 낸다.
+    [{'date': 구간 시작일, 'feed_count': n}] (활동이 없는 구간은 빠진다)
+    """
+    end = end or date.today()
+    rows = DailyActivity.objects.filter(
+        user_id=user_id, day__gt=end - timedelta(days=HEATMAP_DAYS), day__lte=end, feed_count__gt=0
+    )
+    trunc = BUCKETS[bucket]
+    if trunc is None:
+        rows = rows.order_by('day').values('day', 'feed_count')
+        return [{'date': row['day'], 'feed_count': row['feed_count']} for row in rows]
+
+    rows = rows.annotate(bucket=trunc('day')).values('bucket').annotate(total=Sum('feed_count')).order_by('bucket')
+    return [{'date': row['bucket'], 'feed_count': row['total']} for row in rows]
+
+def rebuild_activity(user_id):
+    # 피드에서 하루 활동 수를 다시 계산 (기존 데이터 반영 / 점검용)
+    counts = Feed.objects.filter(user_id=user_id).annotate(day=TruncDate('created_at')).values('day').annotate(count=Count('id'))
+    with transaction.atomic():
+        DailyActivity.objects.filter(user_id=user_id).delete()
+        DailyActivity.objects.bulk_create([
+            DailyActivity(user_id=user_id, day=row['day'], feed_count=row['count']) for row in counts
+        ])
@@ -1,89 +1,265 @@
+import abc
+import asyncio
 import json
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from ..models import ChatMessage, ChatRoom
-from django.contrib.auth.models import User
+from django.db.models import Q
 from channels.db import database_sync_to_async
+from django.conf import settings
+from urllib.parse import parse_qs
+from .message_queue import get_chat_message_queue
+from .events import room_group_name, user_group_name, room_groups, message_frame
+from .ephemeral import PRESENCE_TTL, SignalThrottle, get_room_signal_aggregator, presence_key
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
 
-class ChatConsumer(AsyncWebsocketConsumer):
+# 읽음 처리를 모아서 반영하는 간격(초)
+READ_RECEIPT_DELAY = getattr(settings, 'CHAT_READ_RECEIPT_DELAY', 1.0)
+# 재접속 시 한 번에 다시 보내는 최대 메시지 수 (넘으면 REST 로 이어서 조회)
+RESUME_LIMIT = getattr(settings, 'CHAT_RESUME_LIMIT', 500)
+# 연결 종료 시 이 연결이 보낸 메시지의 저장을 기다리는 최대 시간(초)
+DISCONNECT_SAVE_TIMEOUT = getattr(settings, 'CHAT_DISCONNECT_SAVE_TIMEOUT', 5.0)
+
+class BaseChatConsumer(AsyncWebsocketConsumer, metaclass=abc.ABCMeta):
+    """
+    채팅 소켓 공통 처리. 연결 시 한 번만 인증하고 참여 중인 채팅방을 연결에 캐시한다.
+    메시지는 채팅방 그룹(방 단위 소켓)과 참여자별 유저 그룹(통합 소켓)에 함께 전달된다.
+    """
     async def connect(self):
-        self.room_name = self.scope["url_route"]["kwargs"]["room_number"]
-        self.room_group_name = "chat_%s" % self.room_name
+        # 연결 시 한 번만 인증 / 채팅방 참여 여부를 확인하고 연결 동안 재사용
+        self.user = self.scope.get("user")
+        if self.user is None or not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.rooms = await self.get_connection_rooms()
+        if self.rooms is None:
+            await self.close()
+            return
+        self.pending_reads = {}
+        self.read_receipt_task = None
+        self.pending_saves = set()
 
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        self.joined_groups = self.get_group_names()
+        for group in self.joined_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
         await self.accept()
 
+        # 접속 상태는 캐시(TTL)와 채널 레이어로만 관리하고 DB 에는 쓰지 않는다
+        self.signal_throttle = SignalThrottle()
+        await self.set_presence(True)
+        await self.send_presence()
+
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if getattr(self, "joined_groups", None) is None:
+            return
+        for group in self.joined_groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        if self.read_receipt_task is not None:
+            self.read_receipt_task.cancel()
+        await self.set_presence(False)
+        # 이 연결이 보낸 메시지의 저장만 기다린 뒤 읽음 처리를 반영 (진행 중인 메시지를 보호하는 유일한 단계)
+        if self.pending_saves:
+            await asyncio.wait(list(self.pending_saves), timeout=DISCONNECT_SAVE_TIMEOUT)
+        await self.flush_read_receipts()
+
+    @sync_to_async
+    def count_connection(self, delta):
+        # 유저의 열린 소켓 수를 더하고 결과를 반환 (키가 만료됐으면 이 소켓부터 다시 센다)
+        key = presence_key(self.user.id)
+        cache.add(key, 0, PRESENCE_TTL)
+        try:
+            count = cache.incr(key, delta)
+        except ValueError:
+            count = max(delta, 0)
+            cache.set(key, count, PRESENCE_TTL)
+        if count <= 0:
+            cache.delete(key)
+        else:
+            cache.touch(key, PRESENCE_TTL)
+        return count
+
+    async def set_presence(self, online):
+        # 첫 소켓이 열리거나 마지막 소켓이 닫힐 때만 online / offline 을 알린다.
+        # 재접속이 반복되어도 aggregator 가 AGGREGATE_WINDOW 동안 유저별 마지막 상태만 보내므로 따로 throttle 하지 않는다
+        count = await self.count_connection(1 if online else -1)
+        if count != (1 if online else 0):
+            return
+
+        state = "online" if online else "offline"
+        aggregator = get_room_signal_aggregator()
+        for room in self.rooms.values():
+            aggregator.add(room, self.user.username, state)
+
+    async def send_presence(self):
+        # 연결한 채팅방 상대들의 접속 여부를 캐시 조회 한 번으로 전달
+        others = {}
+        for room in self.rooms.values():
+            receiver = self.get_receiver(room)
+            if receiver is not None:
+                others[presence_key(receiver.pk)] = receiver.username
+        online = await sync_to_async(cache.get_many)(list(others))
+
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'users': {username: key in online for key, username in others.items()},
+        }))
+
+    @abc.abstractmethod
+    async def get_connection_rooms(self):
+        # {room_number: ChatRoom}, 연결할 수 없으면 None
+        pass
+
+    @abc.abstractmethod
+    def get_group_names(self):
+        pass
+
+    @abc.abstractmethod
+    async def get_message_room(self, text_data_json):
+        # 프레임이 가리키는 채팅방 (참여하지 않은 방이면 None)
+        pass
 
     @database_sync_to_async
     def get_room(self, room_number):
-        return ChatRoom.objects.get(id=room_number)
+        return ChatRoom.objects.select_related('starter', 'receiver').filter(
+            Q(starter=self.user) | Q(receiver=self.user), pk=room_number
+        ).first()
 
-    @database_sync_to_async
-    def get_sender(self, username):
-        return User.objects.get(username=username)
+    def get_receiver(self, room):
+        return room.receiver if room.starter_id == self.user.id else room.starter
+
+    async def broadcast(self, room, event):
+        for group in room_groups(room):
+            await self.channel_layer.group_send(group, event)
 
     @database_sync_to_async
-    def save_chat_message(self, room, sender, message, receiver, chat_uuid):
-        chat_msg = ChatMessage(chat_room=room, sender=sender, message=message, read_or_not=False, receiver=receiver, chat_uuid=chat_uuid)
-        chat_msg.save()
+    def get_missed_messages(self, room, resume_from):
+        return list(ChatMessage.objects.filter(
+            chatroom=room, seq__gt=resume_from
+        ).select_related('author').order_by('seq')[:RESUME_LIMIT + 1])
+
+    async def resume(self, room, resume_from):
+        # 그룹에 먼저 들어간 뒤 DB 에서 빈 구간만 다시 보낸다.
+        # 이후 저장되는 메시지는 chat_committed 로 오므로 누락 없이 seq 로 중복 제거 가능
+        missed = await self.get_missed_messages(room, resume_from)
+        await self.send(text_data=json.dumps({
+            'type': 'chat_resume',
+            'room_number': room.pk,
+            'messages': [message_frame(chat_msg) for chat_msg in missed[:RESUME_LIMIT]],
+            'complete': len(missed) <= RESUME_LIMIT,
+        }))
+
+    async def save_chat_message(self, room, sender, message, chat_uuid):
+        chat_msg = ChatMessage(chatroom=room, author=sender, content=message, chat_uuid=chat_uuid)
+        future = await get_chat_message_queue().put(chat_msg)
+        self.pending_saves.add(future)
+        future.add_done_callback(lambda future: self.saved(chat_msg, future))
+
+    def saved(self, chat_msg, future):
+        self.pending_saves.discard(future)
+        if future.cancelled() or future.exception() is not None:
+            # 재시도 후에도 저장하지 못한 메시지는 보낸 사람에게 알려서 다시 보내게 한다
+            asyncio.ensure_future(self.send(text_data=json.dumps({
+                'type': 'chat_failed',
+                'room_number': chat_msg.chatroom_id,
+                'chat_uuid': str(chat_msg.chat_uuid),
+            })))
 
     @database_sync_to_async
-    def get_chat_message_and_read_check(self, chat_uuid, receiver):
+    def mark_read(self, room, chat_uuid):
+        message_id = ChatMessage.objects.filter(chatroom=room, chat_uuid=chat_uuid).values_list('id', flat=True).first()
+        if message_id is None or not room.mark_read(self.user.id, message_id):
+            return None
+        return message_id
+
+    def queue_read_receipt(self, room, chat_uuid):
+        # chat_uuid 메시지까지 모두 읽음 (READ_RECEIPT_DELAY 동안 채팅방별로 마지막 요청만 남긴다)
+        self.pending_reads[room.pk] = (room, chat_uuid)
+        if self.read_receipt_task is None or self.read_receipt_task.done():
+            self.read_receipt_task = asyncio.ensure_future(self.delayed_read_receipts())
+
+    async def delayed_read_receipts(self):
+        await asyncio.sleep(READ_RECEIPT_DELAY)
+        await self.flush_read_receipts()
+
+    async def flush_read_receipts(self):
+        # 채팅방마다 읽은 위치를 한 번만 반영하고 범위 확인 한 번만 브로드캐스트
+        pending_reads, self.pending_reads = self.pending_reads, {}
+        if not pending_reads:
+            return
+
+        # 읽음 위치의 메시지가 아직 이 프로세스의 대기열에 있으면 그 메시지의 저장만 기다린다
+        queue = get_chat_message_queue()
+        for room, chat_uuid in pending_reads.values():
+            await queue.wait_for(chat_uuid, DISCONNECT_SAVE_TIMEOUT)
+        for room, chat_uuid in pending_reads.values():
+            last_read_id = await self.mark_read(room, chat_uuid)
+            if last_read_id is None:
+                continue
+
+            await self.broadcast(room, {
+                "type": "chat_read_up_to",
+                "chat_uuid": str(chat_uuid),
+                "last_read_id": last_read_id,
+                'room_number': room.pk,
+                "receiver": self.user.username,
+            })
+
+    def parse_chat_uuid(self, chat_uuid):
         try:
-            chat_msg = ChatMessage.objects.get(chat_uuid=chat_uuid, receiver=receiver)
-            chat_msg.read_or_not = True
-            chat_msg.save()
-        except ChatMessage.DoesNotExist:
-            pass
+            return uuid.UUID(str(chat_uuid))
+        except ValueError:
+            return uuid.uuid4()
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
 
+        # 접속 유지 신호: 캐시 TTL 만 연장
+        if text_data_json['type'] == 'ping':
+            if self.signal_throttle.allow(None, 'ping'):
+                if not await sync_to_async(cache.touch)(presence_key(self.user.id), PRESENCE_TTL):
+                    await self.count_connection(1)
+            return
+
+        room = await self.get_message_room(text_data_json)
+        if room is None:
+            return
+
+        # 입력 중 표시: 연결 단위로 throttle 후 채팅방별로 모아서 전송
+        if text_data_json['type'] == 'typing':
+            if self.signal_throttle.allow(room.pk, 'typing'):
+                get_room_signal_aggregator().add(room, self.user.username, "typing")
+            return
+
         if text_data_json['type'] == 'chat_message':
             message = text_data_json["message"]
-            username = text_data_json["username"]
-            receiver_username = text_data_json["receiver"]
-            room_number = text_data_json["room_number"]
             created_at = text_data_json["created_at"]
-            chat_uuid = text_data_json["chat_uuid"]
-
-            room = await self.get_room(room_number)
-            sender = await self.get_sender(username)
-            receiver = await self.get_sender(receiver_username)
-
-            await self.save_chat_message(room, sender, message, receiver, chat_uuid)
-
-            await self.channel_layer.group_send(
-                self.room_group_name, {
-                    "type": "chat_message",
-                    "message": message,
-                    "username": username,
-                    "created_at": created_at,
-                    "room_number": room_number,
-                    'chat_uuid': chat_uuid,
-                    'receiver': receiver_username
-                }
-            )
+            chat_uuid = self.parse_chat_uuid(text_data_json.get("chat_uuid"))
+            receiver = self.get_receiver(room)
 
-        if text_data_json['type'] == 'chat_message_read':
-            receiver = text_data_json["receiver"]
-            room_number = text_data_json["room_number"]
-            chat_uuid = text_data_json["chat_uuid"]
+            # 먼저 브로드캐스트하고 저장은 대기열에서 모아서 처리
+            await self.broadcast(room, {
+                "type": "chat_message",
+                "message": message,
+                "username": self.user.username,
+                "created_at": created_at,
+                "room_number": room.pk,
+                'chat_uuid': str(chat_uuid),
+                'receiver': receiver.username if receiver else None
+            })
 
-            receive_user = await self.get_sender(receiver)
+            await self.save_chat_message(room, self.user, message, chat_uuid)
 
-            await self.get_chat_message_and_read_check(chat_uuid, receive_user)
+        if text_data_json['type'] == 'chat_message_read':
+            self.queue_read_receipt(room, self.parse_chat_uuid(text_data_json.get("chat_uuid")))
 
-            await self.channel_layer.group_send(
-                self.room_group_name, {
-                    "type": "chat_message_read",
-                    "chat_uuid": chat_uuid,
-                    'room_number': room_number,
-                    "receiver": receiver,
-                    'is_read': True
-                }
-            )
+        if text_data_json['type'] == 'resume':
+            try:
+                resume_from = int(text_data_json.get("resume_from"))
+            except (TypeError, ValueError):
+                return
+            await self.resume(room, resume_from)
 
     async def chat_message(self, event):
         message = event["message"]
@@ -97,16 +273,112 @@ class ChatConsumer(AsyncWebsocketConsumer):
             "message": message,
             "username": username,
             "created_at": created_at,
-            "room_number": room_number, 
+            "room_number": room_number,
             'chat_uuid': chat_uuid
         }))
-    
-    async def chat_message_read(self, event):
+
+    async def chat_committed(self, event):
         await self.send(text_data=json.dumps({
-            'type': 'chat_message_read',
+            'type': 'chat_committed',
+            'room_number': event['room_number'],
+            'messages': event['messages'],
+        }))
+
+    async def room_signal(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'room_signal',
+            'room_number': event['room_number'],
+            'states': event['states'],
+            'ttl': event['ttl'],
+        }))
+
+    async def chat_read_up_to(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'chat_read_up_to',
             "chat_uuid": event["chat_uuid"],
+            "last_read_id": event["last_read_id"],
             'room_number': event['room_number'],
             "receiver": event["receiver"],
-            "is_read": True
         }))
 
+class ChatConsumer(BaseChatConsumer):
+    """
+    ws/chat/<room_number>/ : 채팅방 하나에 대한 소켓
+    """
+    async def get_connection_rooms(self):
+        self.room_name = self.scope["url_route"]["kwargs"]["room_number"]
+        self.room_group_name = room_group_name(self.room_name)
+
+        self.room = await self.get_room(self.room_name)
+        if self.room is None:
+            return None
+        return {self.room.pk: self.room}
+
+    def get_group_names(self):
+        return [self.room_group_name]
+
+    async def connect(self):
+        await super().connect()
+
+        # ws/chat/<room_number>/?resume_from=<seq> 로 재접속하면 놓친 메시지부터 전달
+        resume_from = parse_qs(self.scope.get('query_string', b'').decode()).get('resume_from', [None])[0]
+        if getattr(self, "joined_groups", None) is not None and resume_from is not None and resume_from.isdigit():
+            await self.resume(self.room, int(resume_from))
+
+    async def get_message_room(self, text_data_json):
+        return self.room
+
+class UserChatConsumer(BaseChatConsumer):
+    """
+    ws/chat/ : 유저의 모든 채팅방을 하나의 소켓으로 받는다.
+    프레임은 room_number 로 구분하고, 열려 있지 않은 채팅방의 메시지는 inbox_update 도 함께 보낸다.
+    """
+    async def get_connection_rooms(self):
+        self.open_room = None
+        return await self.get_user_rooms()
+
+    @database_sync_to_async
+    def get_user_rooms(self):
+        return ChatRoom.objects.select_related('starter', 'receiver').filter(
+            Q(starter=self.user) | Q(receiver=self.user)
+        ).in_bulk()
+
+    def get_group_names(self):
+        return [user_group_name(self.user.id)]
+
+    async def get_message_room(self, text_data_json):
+        try:
+            room_number = int(text_data_json.get("room_number"))
+        except (TypeError, ValueError):
+            return None
+
+        # 연결 이후 새로 생긴 채팅방은 처음 한 번만 조회해서 캐시
+        room = self.rooms.get(room_number)
+        if room is None:
+            room = await self.get_room(room_number)
+            if room is not None:
+                self.rooms[room.pk] = room
+        return room
+
+    async def receive(self, text_data):
+        text_data_json = json.loads(text_data)
+
+        # 클라이언트가 현재 보고 있는 채팅방 (없으면 null)
+        if text_data_json['type'] == 'open_room':
+            room = await self.get_message_room(text_data_json)
+            self.open_room = room.pk if room is not None else None
+            return
+
+        await super().receive(text_data)
+
+    async def chat_message(self, event):
+        await super().chat_message(event)
+
+        if event["room_number"] != self.open_room and event["username"] != self.user.username:
+            await self.send(text_data=json.dumps({
+                'type': 'inbox_update',
+                "room_number": event["room_number"],
+                "message": event["message"][:100],
+                "username": event["username"],
+                "created_at": event["created_at"],
+            }))
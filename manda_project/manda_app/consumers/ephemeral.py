@@ -0,0 +1,82 @@
+import asyncio
+import time
+from collections import defaultdict
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .events import room_groups
+
+# 접속 상태 캐시 유지 시간 / 같은 신호를 다시 보낼 수 있는 최소 간격 / 채팅방별로 모아 보내는 간격(초)
+PRESENCE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+SIGNAL_THROTTLE = getattr(settings, 'CHAT_SIGNAL_THROTTLE', 2.0)
+AGGREGATE_WINDOW = getattr(settings, 'CHAT_SIGNAL_WINDOW', 0.3)
+# 클라이언트가 typing 표시를 유지하는 시간(초)
+TYPING_TTL = getattr(settings, 'CHAT_TYPING_TTL', 5)
+
+def presence_key(user_id):
+    # 값은 유저의 열린 소켓 수 (소켓마다 ping 으로 TTL 연장, 비정상 종료한 소켓은 TTL 이 지나면 사라진다)
+    return "presence_%s" % user_id
+
+class SignalThrottle:
+    """
+    연결 단위로 (채팅방, 신호 종류) 마다 SIGNAL_THROTTLE 초에 한 번만 통과시킨다.
+    """
+    def __init__(self, interval=SIGNAL_THROTTLE):
+        self.interval = interval
+        self.last_sent = {}
+
+    def allow(self, room_id, kind, now=None):
+        now = time.monotonic() if now is None else now
+        key = (room_id, kind)
+        if now - self.last_sent.get(key, float('-inf')) < self.interval:
+            return False
+        self.last_sent[key] = now
+        return True
+
+class RoomSignalAggregator:
+    """
+    프로세스 단위로 typing / online / offline 신호를 채팅방별로 모았다가
+    AGGREGATE_WINDOW 마다 채팅방당 이벤트 한 번으로 보낸다. DB 는 사용하지 않는다.
+    """
+    def __init__(self, window=AGGREGATE_WINDOW, channel_layer=None):
+        self.window = window
+        self.channel_layer = channel_layer
+        self.pending = defaultdict(dict)
+        self.groups = {}
+        self.task = None
+
+    def add(self, room, username, state):
+        self.pending[room.pk][username] = state
+        self.groups[room.pk] = room_groups(room)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, defaultdict(dict)
+        groups, self.groups = self.groups, {}
+        channel_layer = self.channel_layer or get_channel_layer()
+
+        sent = 0
+        for room_id, states in pending.items():
+            event = {
+                "type": "room_signal",
+                "room_number": room_id,
+                "states": states,
+                "ttl": TYPING_TTL,
+            }
+            for group in groups[room_id]:
+                await channel_layer.group_send(group, event)
+                sent += 1
+        return sent
+
+room_signal_aggregator = None
+
+def get_room_signal_aggregator():
+    # 이벤트 루프 안에서 처음 사용할 때 생성
+    global room_signal_aggregator
+    if room_signal_aggregator is None:
+        room_signal_aggregator = RoomSignalAggregator()
+    return room_signal_aggregator
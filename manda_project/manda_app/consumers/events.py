@@ -0,0 +1,21 @@
+def room_group_name(room_number):
+    return "chat_%s" % room_number
+
+def user_group_name(user_id):
+    return "user_%s" % user_id
+
+def room_groups(room):
+    # 방 단위 소켓이 듣는 채팅방 그룹 + 통합 소켓이 듣는 참여자별 유저 그룹
+    groups = [room_group_name(room.pk), user_group_name(room.starter_id)]
+    if room.receiver_id is not None:
+        groups.append(user_group_name(room.receiver_id))
+    return groups
+
+def message_frame(chat_msg):
+    return {
+        "seq": chat_msg.seq,
+        "chat_uuid": str(chat_msg.chat_uuid),
+        "message": chat_msg.content,
+        "username": chat_msg.author.username,
+        "created_at": chat_msg.created_at.isoformat(),
+    }
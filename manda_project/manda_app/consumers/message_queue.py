@@ -0,0 +1,179 @@
+import asyncio
+import logging
+from collections import defaultdict
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from ..models import ChatMessage, ChatRoom
+from .events import room_groups, message_frame
+
+logger = logging.getLogger(__name__)
+
+# 프로세스당 대기열 크기 / 한 번에 저장하는 메시지 수 / 최대 대기 시간(초)
+QUEUE_SIZE = getattr(settings, 'CHAT_QUEUE_SIZE', 10000)
+BATCH_SIZE = getattr(settings, 'CHAT_QUEUE_BATCH_SIZE', 200)
+FLUSH_INTERVAL = getattr(settings, 'CHAT_QUEUE_FLUSH_INTERVAL', 0.05)
+# 저장 실패 시 재시도 횟수 / 첫 재시도 대기 시간(초, 재시도마다 2배)
+PERSIST_RETRIES = getattr(settings, 'CHAT_QUEUE_PERSIST_RETRIES', 3)
+PERSIST_RETRY_DELAY = getattr(settings, 'CHAT_QUEUE_PERSIST_RETRY_DELAY', 0.2)
+
+def save_chat_messages(chat_messages):
+    """
+    배치를 저장하고 실제로 새로 저장된 메시지만 반환한다.
+    채팅방 행을 잠근 뒤 chat_uuid 중복을 확인하므로, 재전송된 메시지가 다른 배치와 동시에 들어와도
+    순번 / 안 읽은 수 / committed 이벤트는 저장된 메시지에만 반영된다.
+    """
+    room_ids = sorted({chat_msg.chatroom_id for chat_msg in chat_messages})
+
+    with transaction.atomic():
+        # 채팅방 행을 잠그고 (같은 채팅방의 배치는 여기서 순서대로 처리된다) 이미 저장된 chat_uuid 를 확인
+        last_seqs = dict(ChatRoom.objects.select_for_update().filter(
+            pk__in=room_ids
+        ).order_by('pk').values_list('pk', 'last_seq'))
+        existing = set(ChatMessage.objects.filter(
+            chat_uuid__in=[chat_msg.chat_uuid for chat_msg in chat_messages]
+        ).values_list('chat_uuid', flat=True))
+
+        new_messages = []
+        for chat_msg in chat_messages:
+            if chat_msg.chat_uuid not in existing:
+                existing.add(chat_msg.chat_uuid)
+                new_messages.append(chat_msg)
+        if not new_messages:
+            return []
+
+        # 채팅방마다 마지막 메시지와 참여자별 안 읽은 수 증가분을 모으고 순서대로 순번을 발급
+        rooms = {}
+        unread = defaultdict(lambda: [0, 0])
+        for chat_msg in new_messages:
+            last_seqs[chat_msg.chatroom_id] += 1
+            chat_msg.seq = last_seqs[chat_msg.chatroom_id]
+            rooms[chat_msg.chatroom_id] = chat_msg
+            if chat_msg.author_id == chat_msg.chatroom.starter_id:
+                unread[chat_msg.chatroom_id][1] += 1
+            else:
+                unread[chat_msg.chatroom_id][0] += 1
+
+        # 잠금 안에서 중복을 걸렀으므로 충돌 무시 없이 저장 (그래도 충돌하면 배치 전체가 롤백되고 재시도)
+        ChatMessage.objects.bulk_create(new_messages)
+        for room_id, latest in rooms.items():
+            starter_unread, receiver_unread = unread[room_id]
+            ChatRoom.objects.filter(pk=room_id).update(
+                last_seq=last_seqs[room_id],
+                latest_message_time=latest.created_at,
+                latest_message=latest.content[:100],
+                starter_unread_count=F('starter_unread_count') + starter_unread,
+                receiver_unread_count=F('receiver_unread_count') + receiver_unread,
+            )
+    return new_messages
+
+persist_chat_messages = database_sync_to_async(save_chat_messages)
+
+async def publish_committed(chat_messages):
+    # 저장된 메시지를 순번과 함께 채팅방마다 이벤트 한 번으로 알린다 (재접속 시 누락 방지)
+    committed = defaultdict(list)
+    for chat_msg in chat_messages:
+        committed[chat_msg.chatroom_id].append(chat_msg)
+
+    channel_layer = get_channel_layer()
+    for room_id, room_messages in committed.items():
+        event = {
+            "type": "chat_committed",
+            "room_number": room_id,
+            "messages": [message_frame(chat_msg) for chat_msg in room_messages],
+        }
+        for group in room_groups(room_messages[0].chatroom):
+            await channel_layer.group_send(group, event)
+
+class ChatMessageQueue:
+    """
+    브로드캐스트 후 메시지를 모아서 bulk_create 로 저장하는 프로세스 단위 대기열.
+    대기열이 가득 차면 put 이 기다리므로 보내는 쪽 연결에 backpressure 가 걸린다.
+    put 은 메시지별 future 를 돌려주므로 연결은 자기 메시지의 저장 결과만 기다릴 수 있다.
+    서버(Daphne) 종료 시 대기열 전체를 비우는 단계는 없다. 진행 중인 메시지는 각 연결의 disconnect 에서
+    DISCONNECT_SAVE_TIMEOUT 동안 기다리는 것으로만 보호되고, 그 안에 저장되지 않은 메시지는
+    클라이언트가 chat_committed 를 받지 못했으므로 재접속 후 chat_uuid 로 다시 보낸다.
+    """
+    def __init__(self, maxsize=QUEUE_SIZE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 retries=PERSIST_RETRIES, retry_delay=PERSIST_RETRY_DELAY):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pending = {}
+        self.worker = None
+
+    async def put(self, chat_msg):
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self.run())
+        future = asyncio.get_event_loop().create_future()
+        self.pending[chat_msg.chat_uuid] = future
+        await self.queue.put((chat_msg, future))
+        return future
+
+    async def wait_for(self, chat_uuid, timeout=None):
+        # 이 프로세스에서 저장 대기 중인 메시지면 저장될 때까지 기다린다
+        future = self.pending.get(chat_uuid)
+        if future is not None:
+            await asyncio.wait([future], timeout=timeout)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self.persist(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def persist(self, batch):
+        chat_messages = [chat_msg for chat_msg, _ in batch]
+        for attempt in range(self.retries + 1):
+            try:
+                saved = await persist_chat_messages(chat_messages)
+                break
+            except Exception as e:
+                logger.exception('Failed to persist %d chat messages (attempt %d)', len(batch), attempt + 1)
+                if attempt == self.retries:
+                    self.resolve(batch, e)
+                    return
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+        self.resolve(batch)
+        try:
+            await publish_committed(saved)
+        except Exception:
+            logger.exception('Failed to publish %d committed chat messages', len(saved))
+
+    def resolve(self, batch, error=None):
+        for chat_msg, future in batch:
+            if self.pending.get(chat_msg.chat_uuid) is future:
+                del self.pending[chat_msg.chat_uuid]
+            if not future.done():
+                if error is None:
+                    future.set_result(chat_msg)
+                else:
+                    future.set_exception(error)
+
+chat_message_queue = None
+
+def get_chat_message_queue():
+    # 이벤트 루프 안에서 처음 사용할 때 생성
+    global chat_message_queue
+    if chat_message_queue is None:
+        chat_message_queue = ChatMessageQueue()
+    return chat_message_queue
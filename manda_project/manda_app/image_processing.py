@@ -0,0 +1,83 @@
+import tempfile
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# 변형 이미지 이름과 긴 변 최대 크기(px). 큰 것부터 만들고 작은 것은 직전 결과를 줄여서 만든다
+IMAGE_VARIANTS = getattr(settings, 'IMAGE_VARIANTS', (
+    ('original', 2048),
+    ('feed', 1080),
+    ('thumb', 320),
+))
+IMAGE_FORMAT = getattr(settings, 'IMAGE_FORMAT', 'WEBP')
+IMAGE_EXTENSION = IMAGE_FORMAT.lower()
+IMAGE_CONTENT_TYPE = 'image/' + IMAGE_EXTENSION
+IMAGE_QUALITY = getattr(settings, 'IMAGE_QUALITY', 80)
+IMAGE_MAX_PIXELS = getattr(settings, 'IMAGE_MAX_PIXELS', 40_000_000)
+IMAGE_ALLOWED_FORMATS = getattr(settings, 'IMAGE_ALLOWED_FORMATS', ('JPEG', 'PNG', 'GIF', 'WEBP'))
+# 이 크기를 넘는 인코딩 결과는 메모리 대신 임시 파일에 둔다
+IMAGE_SPOOL_SIZE = getattr(settings, 'IMAGE_SPOOL_SIZE', 1024 * 1024)
+
+class InvalidImage(Exception):
+    pass
+
+def open_image(fileobj):
+    # 헤더만 읽어 형식 / 크기를 확인한 뒤 한 번만 디코딩한다
+    try:
+        fileobj.seek(0)
+        img = Image.open(fileobj)
+        if img.format not in IMAGE_ALLOWED_FORMATS:
+            raise InvalidImage('Unsupported image format.')
+        if img.width * img.height > IMAGE_MAX_PIXELS:
+            raise InvalidImage('Image is too large.')
+        img = ImageOps.exif_transpose(img)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise InvalidImage('Invalid image file.')
+
+    has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+    return img.convert('RGBA' if has_alpha else 'RGB')
+
+def encode_image(img):
+    output = tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE)
+    img.save(output, IMAGE_FORMAT, quality=IMAGE_QUALITY, method=4)
+    output.seek(0)
+    return output
+
+def variant_sizes():
+    return dict(IMAGE_VARIANTS)
+
+def process_image(fileobj):
+    """
+    업로드 파일을 검증 / 디코딩하고 IMAGE_VARIANTS 크기의 이미지를 만든다.
+    {variant 이름: 인코딩된 파일} 을 반환하며 작은 원본은 확대하지 않는다.
+    """
+    img = open_image(fileobj)
+    variants = {}
+    for name, size in IMAGE_VARIANTS:
+        img.thumbnail((size, size), Image.LANCZOS)
+        variants[name] = encode_image(img)
+    return variants
+
+def pick_variant(variants, width=None):
+    # width 이상인 것 중 가장 작은 변형 (없으면 가장 큰 것). 변형이 없는 예전 이미지는 None
+    if not variants:
+        return None
+    sizes = variant_sizes()
+    available = sorted((sizes[name], key) for name, key in variants.items() if name in sizes)
+    if not available:
+        return None
+    if width is not None:
+        for size, key in available:
+            if size >= width:
+                return key
+    return available[-1][1]
+
+def get_image_width(request, default=None):
+    # ?width=<px> : 클라이언트가 표시할 이미지 너비
+    try:
+        width = int(request.query_params.get('width', default))
+    except (TypeError, ValueError):
+        return default
+    return width if width > 0 else default
+
+# 피드 목록에서 기본으로 내려주는 변형 크기
+FEED_LIST_IMAGE_WIDTH = variant_sizes().get('feed')
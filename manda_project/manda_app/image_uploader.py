@@ -1,26 +1,357 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 import boto3
-import uuid
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import StoredImage
+from .image_processing import process_image, IMAGE_CONTENT_TYPE, IMAGE_EXTENSION, IMAGE_SPOOL_SIZE
 
-class S3ImgUploader:
-    def __init__(self, file):
-        self.file = file
+logger = logging.getLogger(__name__)
+
+# 업로드 백엔드 / 버킷 / 병렬 업로드 워커 수
+IMAGE_STORAGE_BACKEND = getattr(settings, 'IMAGE_STORAGE_BACKEND', 'manda_app.image_uploader.S3Storage')
+IMAGE_STORAGE_BUCKET = getattr(settings, 'IMAGE_STORAGE_BUCKET', 'webmage-bucket')
+IMAGE_STORAGE_ROOT = getattr(settings, 'IMAGE_STORAGE_ROOT', os.path.join(settings.BASE_DIR, 'media'))
+IMAGE_UPLOAD_WORKERS = getattr(settings, 'IMAGE_UPLOAD_WORKERS', 4)
+# 변형 이미지를 업로드 풀에서 병렬로 올린다. 요청은 업로드가 모두 끝날 때까지 기다린다
+IMAGE_UPLOAD_PARALLEL = getattr(settings, 'IMAGE_UPLOAD_PARALLEL', True)
+# 이 크기를 넘으면 multipart 로 나눠서 업로드
+IMAGE_MULTIPART_CHUNK_SIZE = getattr(settings, 'IMAGE_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024)
+# 직접 업로드(presigned) 최대 크기 / 업로드 주소 유효 시간(초)
+IMAGE_UPLOAD_MAX_SIZE = getattr(settings, 'IMAGE_UPLOAD_MAX_SIZE', 20 * 1024 * 1024)
+IMAGE_PRESIGN_EXPIRES = getattr(settings, 'IMAGE_PRESIGN_EXPIRES', 300)
+IMAGE_CDN_URL = getattr(settings, 'IMAGE_CDN_URL', 'https://d3u19o4soz3vn3.cloudfront.net/img')
+# GC 한 번에 지우는 이미지 수 / 참조가 0 이 된 뒤 지우기까지 기다리는 시간(초)
+IMAGE_GC_BATCH_SIZE = getattr(settings, 'IMAGE_GC_BATCH_SIZE', 500)
+IMAGE_GC_GRACE = getattr(settings, 'IMAGE_GC_GRACE', 24 * 60 * 60)
 
-    def upload(self):
-        s3_client = boto3.client(
+def image_url(key):
+    return f'{IMAGE_CDN_URL}/{key}' if key else None
+
+class S3Storage:
+    """
+    프로세스에서 하나의 boto3 client(연결 풀 포함)를 공유한다. boto3 client 는 thread-safe 하다.
+    """
+    def __init__(self, bucket=IMAGE_STORAGE_BUCKET):
+        self.bucket = bucket
+        self.client = boto3.session.Session().client(
             's3',
             aws_access_key_id     = settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key = settings.AWS_SECRET_ACCESS_KEY
+            aws_secret_access_key = settings.AWS_SECRET_ACCESS_KEY,
+            config=Config(max_pool_connections=IMAGE_UPLOAD_WORKERS * 2 + 10),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=IMAGE_MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=IMAGE_MULTIPART_CHUNK_SIZE,
         )
-        url = 'img'+'/'+uuid.uuid1().hex
-        
-        s3_client.upload_fileobj(
-            self.file, 
-            "webmage-bucket", 
-            url, 
-            ExtraArgs={
-                "ContentType": 'image/jpeg/png/jpg'
-            }
+
+    def save(self, key, fileobj, content_type):
+        self.client.upload_fileobj(
+            fileobj, self.bucket, key,
+            ExtraArgs={"ContentType": content_type},
+            Config=self.transfer_config,
+        )
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.ClientError:
+            return False
+        return True
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def size(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+        except self.client.exceptions.ClientError:
+            return None
+
+    def open(self, key):
+        fileobj = tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE)
+        self.client.download_fileobj(self.bucket, key, fileobj, Config=self.transfer_config)
+        fileobj.seek(0)
+        return fileobj
+
+    def presign(self, key, content_type, max_size, expires):
+        # 클라이언트가 S3 로 바로 올리는 POST 주소 ({'url', 'fields'})
+        return self.client.generate_presigned_post(
+            self.bucket, key,
+            Fields={'Content-Type': content_type},
+            Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, max_size]],
+            ExpiresIn=expires,
         )
+
+    def delete_many(self, keys):
+        # DeleteObjects 는 요청당 최대 1000개
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': key} for key in keys[i:i + 1000]],
+                'Quiet': True,
+            })
+
+class UploadRejected(Exception):
+    pass
+
+class LocalUploadMixin:
+    """
+    S3 presigned POST 와 같은 형태(url + fields)로 로컬 업로드 서버(upload/local/) 주소를 발급한다.
+    개발 / 테스트 환경에서 S3 없이 직접 업로드 흐름을 그대로 쓰기 위한 용도
+    """
+    salt = 'manda_app.local_upload'
+
+    def presign(self, key, content_type, max_size, expires):
+        policy = signing.dumps({
+            'key': key,
+            'content_type': content_type,
+            'max_size': max_size,
+            'expires_at': time.time() + expires,
+        }, salt=self.salt)
+        return {
+            'url': reverse('local_storage_upload'),
+            'fields': {'key': key, 'Content-Type': content_type, 'policy': policy},
+        }
+
+    def accept_upload(self, policy, key, content_type, fileobj):
+        # S3 가 POST policy 를 검사하는 것과 같은 조건을 확인하고 저장
+        try:
+            policy = signing.loads(policy or '', salt=self.salt)
+        except signing.BadSignature:
+            raise UploadRejected('Invalid policy.')
+        if policy['expires_at'] < time.time():
+            raise UploadRejected('Policy expired.')
+        if key != policy['key'] or content_type != policy['content_type']:
+            raise UploadRejected('Policy does not match the upload.')
+        if fileobj is None or not 0 < fileobj.size <= policy['max_size']:
+            raise UploadRejected('Invalid file size.')
+        self.save(key, fileobj, content_type)
+
+class LocalStorage(LocalUploadMixin):
+    """
+    로컬 파일시스템에 저장 (개발 / 오프라인 환경)
+    """
+    def __init__(self, root=IMAGE_STORAGE_ROOT):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def save(self, key, fileobj, content_type):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            for chunk in iter(lambda: fileobj.read(64 * 1024), b''):
+                f.write(chunk)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key)) if self.exists(key) else None
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def delete(self, key):
+        if self.exists(key):
+            os.remove(self.path(key))
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+class InMemoryStorage(LocalUploadMixin):
+    """
+    테스트용. 저장한 객체를 dict 에 보관한다.
+    """
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def save(self, key, fileobj, content_type):
+        with self.lock:
+            self.objects[key] = (fileobj.read(), content_type)
+
+    def exists(self, key):
+        return key in self.objects
+
+    def size(self, key):
+        return len(self.objects[key][0]) if key in self.objects else None
+
+    def open(self, key):
+        return io.BytesIO(self.objects[key][0])
+
+    def delete(self, key):
+        with self.lock:
+            self.objects.pop(key, None)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+storage = None
+executor = None
+storage_lock = threading.Lock()
+
+def get_storage():
+    # 설정된 백엔드를 프로세스에서 한 번만 생성해 공유
+    global storage
+    if storage is None:
+        with storage_lock:
+            if storage is None:
+                storage = import_string(IMAGE_STORAGE_BACKEND)()
+    return storage
+
+def get_executor():
+    global executor
+    if executor is None:
+        with storage_lock:
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=IMAGE_UPLOAD_WORKERS, thread_name_prefix='image-upload')
+    return executor
+
+def hash_file(fileobj, output=None):
+    # 청크 단위로 읽으면서 sha256 계산 (output 이 있으면 같은 청크를 복사)
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(64 * 1024), b''):
+        digest.update(chunk)
+        if output is not None:
+            output.write(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+def digest_from_key(key):
+    # img/<digest>/<variant>.<ext> (참조 수를 관리하지 않는 img/raw/<digest> 와 예전 uuid key 는 None)
+    parts = (key or '').split('/')
+    if len(parts) >= 2 and parts[0] == 'img' and len(parts[1]) == 64:
+        return parts[1]
+    return None
+
+def store_many(objects, parallel=None):
+    """
+    {key: (fileobj, content_type)} 를 모두 저장한 뒤 반환한다 (parallel 이면 업로드 풀에서 병렬로 업로드).
+    요청 시간에는 업로드 시간이 포함되지만 (가장 느린 변형 하나만큼), 저장이 끝난 뒤에만 key 를 DB 에
+    기록하므로 없는 객체를 가리키는 참조가 생기지 않는다.
+    풀에서 실패한 업로드는 요청 스레드에서 한 번 더 시도하고, 그래도 실패하면 예외를 올린다.
+    """
+    if parallel is None:
+        parallel = IMAGE_UPLOAD_PARALLEL
+    failed = list(objects)
+    if parallel:
+        futures = {
+            key: get_executor().submit(get_storage().save, key, fileobj, content_type)
+            for key, (fileobj, content_type) in objects.items()
+        }
+        failed = []
+        for key, future in futures.items():
+            try:
+                future.result()
+            except Exception:
+                logger.exception('Failed to upload image %s, retrying', key)
+                failed.append(key)
+
+    for key in failed:
+        fileobj, content_type = objects[key]
+        fileobj.seek(0)
+        get_storage().save(key, fileobj, content_type)
+
+def prepare_image(digest, build):
+    """
+    같은 내용의 이미지가 이미 있으면 업로드를 건너뛰고 그 {variant 이름: key} 를 반환한다.
+    없으면 build() 로 업로드를 모두 마친 뒤에 등록하므로, 등록된 key 는 항상 저장소에 있다.
+    참조 수는 여기서 올리지 않고 프로필 / 피드 저장과 같은 트랜잭션에서 acquire_images 로 올린다.
+    updated_at 을 갱신하므로 그 사이(IMAGE_GC_GRACE 안)에 GC 가 지우지 않는다
+    """
+    now = timezone.now()
+    if StoredImage.objects.filter(digest=digest).update(updated_at=now):
+        variants = StoredImage.objects.filter(digest=digest).values_list('variants', flat=True).first()
+        if variants is not None:
+            return variants
+
+    variants = build()
+    # 같은 이미지가 동시에 업로드된 경우 먼저 등록된 것을 쓴다 (key 가 같으므로 내용도 같다)
+    image, created = StoredImage.objects.get_or_create(digest=digest, defaults={'variants': variants, 'ref_count': 0})
+    if not created:
+        StoredImage.objects.filter(digest=digest).update(updated_at=now)
+    return image.variants
+
+def acquire_images(*keys):
+    # 새로 참조하는 이미지의 참조 수를 올린다 (프로필 / 피드 저장과 같은 트랜잭션에서 호출)
+    acquired = Counter(filter(None, map(digest_from_key, keys)))
+    now = timezone.now()
+    for digest, count in acquired.items():
+        StoredImage.objects.filter(digest=digest).update(ref_count=F('ref_count') + count, updated_at=now)
+
+def release_images(*keys):
+    # 더 이상 쓰지 않는 이미지의 참조 수를 내린다. 실제 삭제는 collect_garbage 에서 모아서 처리
+    released = Counter(filter(None, map(digest_from_key, keys)))
+    now = timezone.now()
+    for digest, count in released.items():
+        StoredImage.objects.filter(digest=digest).update(ref_count=F('ref_count') - count, updated_at=now)
+
+def collect_garbage(batch_size=IMAGE_GC_BATCH_SIZE, grace=IMAGE_GC_GRACE):
+    """
+    참조 수가 0 이하로 grace 초 이상 지난 이미지를 batch_size 개씩 저장소와 DB 에서 지운다.
+    잠긴 행은 건너뛰므로 여러 프로세스에서 동시에 실행해도 된다. 지운 이미지 수를 반환
+    """
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(StoredImage.objects.select_for_update(skip_locked=True).filter(
+                ref_count__lte=0, updated_at__lt=cutoff
+            ).order_by('updated_at')[:batch_size])
+            if not batch:
+                return deleted
+            get_storage().delete_many([key for image in batch for key in image.variants.values()])
+            StoredImage.objects.filter(pk__in=[image.pk for image in batch]).delete()
+        deleted += len(batch)
+
+class S3ImgUploader:
+    def __init__(self, file):
+        self.file = file
+
+    def upload(self, parallel=None):
+        # 내용 해시를 key 로 사용하고 이미 있는 key 면 업로드하지 않는다 (참조 수는 관리하지 않음)
+        content_type = getattr(self.file, 'content_type', None) or 'application/octet-stream'
+        url = 'img/raw'+'/'+hash_file(self.file)
+        if not get_storage().exists(url):
+            store_many({url: (self.file, content_type)}, parallel)
         return url
-    
\ No newline at end of file
+
+    def upload_variants(self, parallel=None):
+        """
+        이미지를 검증하고 변형 이미지(original / feed / thumb)를 만들어 업로드한다.
+        같은 내용의 이미지가 이미 있으면 처리 / 업로드 없이 그 key 를 쓴다.
+        잘못된 이미지면 InvalidImage. {variant 이름: key} 를 반환 (참조 수는 저장할 때 acquire_images 로 올린다)
+        """
+        digest = hash_file(self.file)
+
+        def build():
+            base = 'img'+'/'+digest
+            variants = process_image(self.file)
+            keys = {name: f'{base}/{name}.{IMAGE_EXTENSION}' for name in variants}
+            try:
+                store_many({keys[name]: (fileobj, IMAGE_CONTENT_TYPE) for name, fileobj in variants.items()}, parallel)
+            finally:
+                for fileobj in variants.values():
+                    fileobj.close()
+            return keys
+        return prepare_image(digest, build)
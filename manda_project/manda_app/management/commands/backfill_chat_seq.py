@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from ...models import ChatRoom
+
+class Command(BaseCommand):
+    help = '순번(seq)이 없는 예전 채팅 메시지에 채팅방별 순번을 발급합니다. 클라이언트가 재접속하기 전에 실행하세요.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_numbers', nargs='*', type=int, help='비우면 seq 가 없는 메시지가 있는 전체 채팅방')
+
+    def handle(self, *args, **options):
+        rooms = ChatRoom.objects.filter(messages__seq__isnull=True).distinct()
+        if options['room_numbers']:
+            rooms = rooms.filter(pk__in=options['room_numbers'])
+
+        room_count = message_count = 0
+        for room in rooms:
+            message_count += room.backfill_seq()
+            room_count += 1
+        self.stdout.write(f'채팅방 {room_count} 개 / 메시지 {message_count} 개 순번 발급')
@@ -0,0 +1,55 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+from ...consumers.ephemeral import SignalThrottle, RoomSignalAggregator
+
+class Command(BaseCommand):
+    help = 'typing / presence 신호 처리량(초당 이벤트 수)을 워커 하나 기준으로 측정합니다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=1000)
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--events', type=int, default=200000)
+
+    def handle(self, *args, **options):
+        result = asyncio.run(self.run(options['rooms'], options['connections'], options['events']))
+        self.stdout.write(
+            '입력 {events} 건 / {elapsed:.3f}초 = {rate:,.0f} events/s, '
+            'throttle 통과 {allowed} 건, 브로드캐스트 {sent} 건'.format(**result)
+        )
+
+    async def run(self, room_count, connection_count, event_count):
+        rooms = [SimpleNamespace(pk=i, starter_id=i, receiver_id=i + room_count) for i in range(room_count)]
+        throttles = [SignalThrottle() for _ in range(connection_count)]
+        # 채널 레이어 전송까지 포함해서 측정 (window 는 수동 flush)
+        aggregator = RoomSignalAggregator(window=3600, channel_layer=InMemoryChannelLayer())
+
+        allowed = 0
+        sent = 0
+        now = 0.0
+        start = time.perf_counter()
+        for i in range(event_count):
+            # 연결마다 10ms 간격으로 typing 신호를 보내는 상황을 가정
+            now += 0.01 / connection_count
+            connection = i % connection_count
+            room = rooms[connection % room_count]
+            if throttles[connection].allow(room.pk, 'typing', now):
+                aggregator.add(room, f'user{connection}', 'typing')
+                allowed += 1
+            if i % 1000 == 999:
+                sent += await aggregator.flush()
+        sent += await aggregator.flush()
+        # 통과한 신호가 없으면 예약된 flush 도 없다
+        if aggregator.task is not None:
+            aggregator.task.cancel()
+        elapsed = time.perf_counter() - start
+
+        return {
+            'events': event_count,
+            'elapsed': elapsed,
+            'rate': event_count / elapsed,
+            'allowed': allowed,
+            'sent': sent,
+        }
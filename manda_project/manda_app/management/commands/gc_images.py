@@ -0,0 +1,20 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ...models import UsedUploadToken
+from ...image_uploader import IMAGE_GC_BATCH_SIZE, IMAGE_GC_GRACE, collect_garbage
+from ...manda_views.views_upload import UPLOAD_TOKEN_MAX_AGE
+
+class Command(BaseCommand):
+    help = '참조되지 않는 업로드 이미지를 저장소와 DB 에서 일정 개수씩 나눠 삭제합니다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=IMAGE_GC_BATCH_SIZE)
+        parser.add_argument('--grace', type=int, default=IMAGE_GC_GRACE, help='참조가 0 이 된 뒤 기다리는 시간(초)')
+
+    def handle(self, *args, **options):
+        deleted = collect_garbage(options['batch_size'], options['grace'])
+        # 만료된 토큰은 서명 확인에서 거절되므로 사용 기록도 지운다
+        cutoff = timezone.now() - timedelta(seconds=UPLOAD_TOKEN_MAX_AGE)
+        tokens, _ = UsedUploadToken.objects.filter(used_at__lt=cutoff).delete()
+        self.stdout.write(f'이미지 {deleted} 개 삭제, 만료된 업로드 토큰 {tokens} 개 삭제')
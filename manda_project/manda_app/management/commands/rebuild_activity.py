@@ -0,0 +1,17 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from ...activity import rebuild_activity
+
+class Command(BaseCommand):
+    help = '유저별 하루 활동 수(히트맵)를 피드에서 다시 계산합니다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help='비우면 전체 유저')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids'] or User.objects.values_list('id', flat=True)
+        count = 0
+        for user_id in user_ids:
+            rebuild_activity(user_id)
+            count += 1
+        self.stdout.write(f'유저 {count} 명 재계산')
@@ -0,0 +1,19 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ...progress import rebuild_progress
+
+class Command(BaseCommand):
+    help = '세부목표 / 핵심목표 / 프로필의 실천 누적값을 실천목표에서 다시 계산합니다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help='비우면 전체 유저')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids'] or User.objects.values_list('id', flat=True)
+        count = 0
+        for user_id in user_ids:
+            with transaction.atomic():
+                rebuild_progress(user_id)
+            count += 1
+        self.stdout.write(f'유저 {count} 명 재계산')
@@ -6,9 +6,11 @@ urlpatterns = [
     path('edit/main/', views_mandas.update_manda_main, name='edit_main'),
     path('edit/sub/', views_mandas.update_manda_subs, name='edit_sub'),
     path('edit/content/', views_mandas.update_manda_contents, name='edit_content'),
+    path('checkin/<int:content_id>', views_mandas.check_in_content, name='checkin_content'),
     path('delete/<int:manda_id>', views_mandas.manda_main_delete, name='delete_manda'),
     path('mandamain/<int:manda_id>', views_mandas.select_mandalart, name='mandamain'),
     path('<int:user_id>/', views_mandas.manda_main_list, name='usermanda'),
     path('others/', views_mandas.others_manda_main_list, name='others'),
+    path('progress/<int:manda_id>', views_mandas.manda_progress, name='manda_progress'),
     path('mandasimple/<int:manda_id>', views_mandas.manda_main_sub, name='mandasimple'),
 ]
\ No newline at end of file
@@ -0,0 +1,8 @@
+from django.urls import path
+from ..manda_views import views_upload
+
+urlpatterns = [
+    path('presign/', views_upload.presign_upload, name='presign_upload'),
+    path('finalize/', views_upload.finalize_upload, name='finalize_upload'),
+    path('local/', views_upload.local_storage_upload, name='local_storage_upload'),
+]
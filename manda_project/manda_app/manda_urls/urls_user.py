@@ -13,4 +13,5 @@ urlpatterns = [
     path('profile/write', views_users.write_profile, name='write_profile'),
     path('profile/edit', views_users.edit_profile, name='edit_profile'),
     path('profile/<int:user_id>', views_users.view_profile, name='view_profile'),
+    path('profile/batch', views_users.view_profiles, name='view_profiles'),
 ]
\ No newline at end of file
@@ -3,11 +3,14 @@ from django.utils import timezone
 from ..models import ChatRoom, ChatMessage, UserProfile
 from django.contrib.auth.models import User
 from django.db.models import Q
+from django.db.models.functions import Coalesce
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
 
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
+from ..pagination import KeysetPaginator, pagination_parameters
 
 def format_datetime(dt):
     today = timezone.now().date()
@@ -18,43 +21,41 @@ def format_datetime(dt):
         return dt.strftime("어제 %p %I:%M")
     return dt.strftime("%Y-%m-%d %p %I:%M")
 
+@swagger_auto_schema(method='get', manual_parameters=pagination_parameters)
 @api_view(['GET'])
 def get_rooms(request):
-    chat_rooms = ChatRoom.objects.filter(Q(starter=request.user.id) | Q(receiver=request.user.id))
+    user_id = request.user.id
+
+    # 채팅방에 저장된 마지막 메시지 / 안 읽은 수를 그대로 사용 (쿼리 한 번)
+    chat_rooms = ChatRoom.objects.filter(
+        Q(starter=user_id) | Q(receiver=user_id)
+    ).select_related('starter', 'receiver').annotate(
+        last_activity=Coalesce('latest_message_time', 'created_at'),
+    )
+    # 최근 대화 순으로 정렬 (메시지가 없는 방은 생성 시각 기준)
+    chat_rooms, next_cursor = KeysetPaginator(ordering=('-last_activity', '-room_number')).paginate(request, chat_rooms)
 
     latest_messages = []
 
     for room in chat_rooms:
-        try:
-            unread_message_count = ChatMessage.objects.filter(
-                Q(chatroom=room),
-                ~Q(author=request.user),
-                Q(is_read=False)
-            ).count()
-
-            latest_message = ChatMessage.objects.filter(chatroom=room).latest('created_at')
-            starter = None
-
-            if latest_message.chatroom.starter == request.user:
-                starter = latest_message.chatroom.starter
+        if room.latest_message_time is not None:
+            if room.starter_id == user_id:
+                starter = room.starter
+                unread_message_count = room.starter_unread_count
             else:
-                starter = latest_message.chatroom.receiver 
+                starter = room.receiver
+                unread_message_count = room.receiver_unread_count
 
             latest_messages.append({
                 'chat_room_id': room.pk,
                 'starter_id': starter.pk,
                 'starter': starter.username,
-                'message': latest_message.content,
-                'created_at': format_datetime(latest_message.created_at),
+                'message': room.latest_message,
+                'created_at': format_datetime(room.latest_message_time),
                 'unread_message_count': unread_message_count,
             })
-        except ChatMessage.DoesNotExist:
-            starter = None
-
-            if room.starter.pk == request.user.id:
-                starter = User.objects.get(pk=request.user.id)
-            else:
-                starter = room.starter
+        else:
+            starter = room.starter
 
             latest_messages.append({
                 'chat_room_id': room.pk,
@@ -65,34 +66,70 @@ def get_rooms(request):
                 'unread_message_count': 0,
             })
 
-    latest_messages.sort(key=lambda x: x['created_at'], reverse=True)
-
-    return Response({'rooms':latest_messages}, status=status.HTTP_200_OK)
+    return Response({'rooms': latest_messages, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
 
+@swagger_auto_schema(
+    method='get',
+    manual_parameters=pagination_parameters + [
+        openapi.Parameter('since', openapi.IN_QUERY, description='이 메시지 id 이후의 메시지만 조회', type=openapi.TYPE_INTEGER),
+    ]
+)
 @api_view(['GET'])
+@permission_classes([IsAuthenticated])
 def chat_history(request, room_number, sender_id):
     current_chat = None
     formatted_chat_msgs = []
     first_unread_index = -1
-
-    current_room = ChatRoom.objects.get(pk=room_number)
-    current_chat = ChatMessage.objects.filter(chatroom=current_room).order_by('created_at')
-
-    for chat in current_chat:
-        if chat.is_read == False:
-            if chat.author.pk != request.user.id:
-                chat.is_read = True
-                chat.save()
-                if first_unread_index == -1:
-                    first_unread_index = chat.pk
+    read = {}
+
+    # 참여 중인 채팅방만 조회 / 읽음 처리할 수 있다
+    current_room = ChatRoom.objects.filter(
+        Q(starter=request.user) | Q(receiver=request.user), pk=room_number
+    ).first()
+    if current_room is None:
+        return Response({'error': 'Chat room does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+    room_chat = ChatMessage.objects.filter(chatroom=current_room).select_related('author')
+
+    since = request.query_params.get('since')
+    if since is not None and since.isdigit():
+        # 재접속한 클라이언트는 놓친 메시지만 오래된 순으로 받아간다
+        current_chat, next_cursor = KeysetPaginator(ordering=('id',)).paginate(request, room_chat.filter(id__gt=since))
+    else:
+        # 최신 메시지부터 한 페이지씩 거꾸로 불러오고, 화면에는 오래된 순으로 전달
+        current_chat, next_cursor = KeysetPaginator(ordering=('-created_at', '-id')).paginate(request, room_chat)
+        current_chat.reverse()
+
+    if current_chat:
+        user_id = request.user.id
+        last_read_id = getattr(current_room, current_room.last_read_field(user_id))
+        oldest_id = min(chat.pk for chat in current_chat)
+        newest_id = max(chat.pk for chat in current_chat)
+
+        first_unread = ChatMessage.objects.filter(
+            chatroom=current_room, id__gt=last_read_id, id__lte=newest_id
+        ).exclude(author=user_id).order_by('id').values_list('id', flat=True).first()
+        if first_unread is not None:
+            first_unread_index = first_unread
+            # 첫 안 읽은 메시지부터 이어지는 페이지를 받았을 때만 읽은 위치를 옮긴다.
+            # 그보다 앞의 안 읽은 메시지가 빠진 페이지(since / 크기 제한)는 읽음 처리하지 않음
+            if first_unread >= oldest_id:
+                current_room.mark_read(user_id, newest_id)
+                setattr(current_room, current_room.last_read_field(user_id), newest_id)
+
+        # 상대가 쓴 메시지는 내 watermark, 내가 쓴 메시지는 상대 watermark 기준으로 읽음 여부 판단
+        my_last_read = getattr(current_room, current_room.last_read_field(user_id))
+        other_last_read = current_room.receiver_last_read_id if current_room.starter_id == user_id else current_room.starter_last_read_id
+        for chat in current_chat:
+            read[chat.pk] = chat.pk <= (other_last_read if chat.author_id == user_id else my_last_read)
 
     for chat in current_chat:
         formatted_chat_msgs.append({
             'created_at': format_datetime(chat.created_at),
             'message': chat.content,
             'username': chat.author.username,
-            'is_read': chat.is_read, 
+            'is_read': read[chat.pk],
             'id': chat.pk,
+            'seq': chat.seq,
         })
 
     sender_name = User.objects.get(pk=sender_id).username
@@ -101,7 +138,8 @@ def chat_history(request, room_number, sender_id):
         "room_number" : room_number,
         "chat_msgs" : formatted_chat_msgs,
         'first_unread_index': first_unread_index,
-        'sender': sender_name
+        'sender': sender_name,
+        'next_cursor': next_cursor
     }
 
     return Response(context, status=status.HTTP_200_OK)
\ No newline at end of file
@@ -1,4 +1,5 @@
 from rest_framework import status
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 from rest_framework.response import Response
@@ -6,31 +7,79 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from ..models import Feed, Comment  # You will need to create these models based on the API spec provided
 from ..serializers.comment_serializer import CommentSerializer  # You will need to create these serializers
-from ..serializers.feed_serializer import FeedSerializer
+from ..serializers.feed_serializer import FeedSerializer, ReactionSerializer
+from ..reactions import add_reaction, remove_reaction, get_emoji_counts
+from ..timeline import fan_out_feed, read_timeline
+from ..activity import BUCKETS, activity_heatmap, record_feed_activity
+from ..image_processing import InvalidImage, FEED_LIST_IMAGE_WIDTH, get_image_width
+from ..image_uploader import S3ImgUploader, acquire_images, release_images
+from ..pagination import KeysetPaginator, pagination_parameters, encode_cursor, decode_cursor, get_page_size
 from drf_yasg.utils import swagger_auto_schema
-from django.db.models import Count, Q
+from drf_yasg import openapi
+from django.utils.dateparse import parse_date
+
+image_width_parameter = openapi.Parameter(
+    'width', openapi.IN_QUERY, description='Display width in px; the smallest image variant that fits is returned',
+    type=openapi.TYPE_INTEGER,
+)
+
+def feed_list_context(request):
+    return {'image_width': get_image_width(request, FEED_LIST_IMAGE_WIDTH)}
+
+def upload_feed_image(request):
+    # Validate, resize and upload the feed image once; returns the extra fields to save.
+    image_file = request.FILES.get('feed_image')
+    if image_file is None:
+        return {}
+    variants = S3ImgUploader(image_file).upload_variants()
+    return {'feed_image': variants['original'], 'feed_image_variants': variants}
 
 # Get feed of a specific user
+@swagger_auto_schema(method='get', manual_parameters=pagination_parameters + [image_width_parameter])
 @api_view(['GET'])
 def return_feed(request, user_id):
-    feed_objects = Feed.objects.filter(user=user_id)
-    serializer = FeedSerializer(feed_objects, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    paginator = KeysetPaginator(ordering=('-created_at', '-id'))
+    feed_objects, next_cursor = paginator.paginate(request, Feed.objects.filter(user=user_id))
+    serializer = FeedSerializer(feed_objects, many=True, context=feed_list_context(request))
+    return Response({'feeds': serializer.data, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
 
-# Get feed logs for a specific user
+# Get the activity heatmap of a specific user (one year up to ?end=, bucketed by day / week / month)
+@swagger_auto_schema(method='get', manual_parameters=[
+    openapi.Parameter('bucket', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(BUCKETS), default='day'),
+    openapi.Parameter('end', openapi.IN_QUERY, description='Last day of the range (YYYY-MM-DD), defaults to today',
+                      type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+])
 @api_view(['GET'])
 def return_feed_log(request, user_id):
-    logs = Feed.objects.filter(user=user_id).values('created_at').annotate(feed_count=Count('id'))
-    return Response(logs, status=status.HTTP_200_OK)
+    bucket = request.query_params.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        return Response({'error': 'bucket must be one of day, week, month.'}, status=status.HTTP_400_BAD_REQUEST)
+    end = request.query_params.get('end')
+    if end is not None:
+        try:
+            end = parse_date(end)
+        except ValueError:
+            end = None
+        if end is None:
+            return Response({'error': 'end must be a date (YYYY-MM-DD).'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Reads the DailyActivity rollup kept current by write_feed / delete_feed.
+    logs = activity_heatmap(user_id, end, bucket)
+    return Response({'bucket': bucket, 'logs': logs}, status=status.HTTP_200_OK)
 
 # Get the timeline for a specific user
+@swagger_auto_schema(method='get', manual_parameters=pagination_parameters + [image_width_parameter])
 @api_view(['GET'])
 def return_timeline(request, user_id):
-    # This might include the user's feed as well as feeds from their followers.
-    # Placeholder logic is provided here. Adjust based on actual requirements.
-    timeline_objects = Feed.objects.filter(Q(user_id=user_id) | Q(user__followers__id=user_id))
-    serializer = FeedSerializer(timeline_objects, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    # Served from the per-user timeline index filled by write_feed.
+    cursor = decode_cursor(request.query_params.get('cursor'))
+    feed_id = cursor[0] if cursor and isinstance(cursor[0], int) else None
+    feeds, next_cursor = read_timeline(user_id, feed_id, get_page_size(request))
+    serializer = FeedSerializer(feeds, many=True, context=feed_list_context(request))
+    return Response({
+        'feeds': serializer.data,
+        'next_cursor': encode_cursor([next_cursor]) if next_cursor else None,
+    }, status=status.HTTP_200_OK)
 
 # Write a new feed
 @swagger_auto_schema(method='post', request_body=FeedSerializer)
@@ -39,7 +88,15 @@ def return_timeline(request, user_id):
 def write_feed(request):
     serializer = FeedSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save(user=request.user)
+        try:
+            image_fields = upload_feed_image(request)
+        except InvalidImage as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            feed = serializer.save(user=request.user, **image_fields)
+            acquire_images(feed.feed_image.name)
+            fan_out_feed(feed)
+            record_feed_activity(feed.user_id, feed.created_at.date(), 1)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -51,18 +108,54 @@ def edit_feed(request, feed_id):
     feed = get_object_or_404(Feed, id=feed_id)
     serializer = FeedSerializer(feed, data=request.data, partial=True)
     if serializer.is_valid():
-        serializer.save()
+        try:
+            image_fields = upload_feed_image(request)
+        except InvalidImage as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        old_image = feed.feed_image.name
+        with transaction.atomic():
+            feed = serializer.save(**image_fields)
+            if image_fields:
+                acquire_images(feed.feed_image.name)
+                release_images(old_image)
         return Response(serializer.data, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-# Set emoji on a feed
-@api_view(['PATCH'])
-def set_feed_emoji(request, feed_id):
+# Delete a feed; its image is released and collected later by gc_images
+@api_view(['DELETE'])
+@permission_classes([IsAuthenticated])
+def delete_feed(request, feed_id):
     feed = get_object_or_404(Feed, id=feed_id)
-    emoji_count = request.data.get('emoji_count', {})
-    feed.emoji_count = emoji_count  # Assuming this is a JSONField
-    feed.save()
-    return Response({'message': 'Emoji updated successfully.'}, status=status.HTTP_200_OK)
+    if feed.user_id != request.user.id:
+        return Response({'error': 'You can only delete your own feed.'}, status=status.HTTP_403_FORBIDDEN)
+    with transaction.atomic():
+        feed.delete()
+        release_images(feed.feed_image.name)
+        record_feed_activity(feed.user_id, feed.created_at.date(), -1)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+# React to a feed with an emoji (POST adds, DELETE removes)
+@swagger_auto_schema(methods=['post', 'delete'], request_body=ReactionSerializer)
+@api_view(['POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def react_feed(request, feed_id):
+    serializer = ReactionSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    if not Feed.objects.filter(id=feed_id).exists():
+        return Response({'error': 'Feed does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+
+    emoji_name = serializer.validated_data['emoji_name']
+    if request.method == 'POST':
+        add_reaction(request.user, feed_id, emoji_name)
+    else:
+        remove_reaction(request.user, feed_id, emoji_name)
+    return Response({'emoji_count': get_emoji_counts(feed_id)}, status=status.HTTP_200_OK)
+
+# Get emoji counts of a feed
+@api_view(['GET'])
+def return_feed_emoji(request, feed_id):
+    return Response({'emoji_count': get_emoji_counts(feed_id)}, status=status.HTTP_200_OK)
 
 # Comment on a feed
 @api_view(['POST'])
@@ -1,12 +1,17 @@
 from rest_framework import status
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 from rest_framework.response import Response
 from django.http import HttpResponse, JsonResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
-from ..models import MandaMain, MandaSub, MandaContent
+from ..models import MandaMain, MandaSub, MandaContent, Feed
 from ..serializers.manda_serializer import *
+from ..pagination import KeysetPaginator, pagination_parameters
+from ..progress import apply_progress, log_practice, remove_main_progress, check_in, practice_streak
+from ..image_uploader import release_images
+from ..activity import remove_feeds_activity
 import json
 
 from drf_yasg.utils import swagger_auto_schema
@@ -20,13 +25,11 @@ def manda_main_create(request):
     serializer = MandaMainSerializer(data=request.data)
 
     if serializer.is_valid():
-        serializer.save(user=user)
-        
-        manda_sub_objects = MandaSub.objects.filter(main_id=serializer.data['id'])
-        manda_sub_serializer = MandaSubSerializer(manda_sub_objects, many=True)
+        manda_main = serializer.save(user=user)
 
-        manda_content_objects = MandaContent.objects.filter(sub_id__in=manda_sub_objects)
-        manda_content_serializer = MandaContentSerializer(manda_content_objects, many=True)
+        # save() 에서 만든 객체를 그대로 직렬화 (재조회 없음)
+        manda_sub_serializer = MandaSubSerializer(manda_main.grid_subs, many=True)
+        manda_content_serializer = MandaContentSerializer(manda_main.grid_contents, many=True)
 
         response_data = {
             'main': serializer.data,
@@ -69,16 +72,29 @@ def update_manda_main(request):
             except MandaMain.DoesNotExist:
                 return Response(f"MandaMain with ID {main_id} does not exist for the current user.", status=status.HTTP_404_NOT_FOUND)
 
-            if 'success' in request.data:
-                new_success = request.data.get('success')
-                manda_main.success = new_success
-
+            # 성공 여부는 실천목표에서 집계하므로 제목만 반영
             manda_main.main_title = main_title
-            manda_main.save()
+            manda_main.save(update_fields=['main_title'])
             
         return Response(serializer.data, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def bulk_update_changed(model, objects, items, fields):
+    # 값이 바뀐 객체와 필드만 모아서 bulk_update 한 번으로 반영
+    changed_objects = {}
+    changed_fields = set()
+    for item in items:
+        obj = objects[item['id']]
+        for field in fields:
+            if field in item and getattr(obj, field) != item[field]:
+                setattr(obj, field, item[field])
+                changed_objects[obj.id] = obj
+                changed_fields.add(field)
+
+    if changed_objects:
+        model.objects.bulk_update(changed_objects.values(), sorted(changed_fields))
+    return list(changed_objects.values())
+
 """
 {
   "subs": [
@@ -108,21 +124,20 @@ def update_manda_subs(request):
     serializer = MandaSubUpdateSerializer(data=data.get('subs', []), many=True)
 
     if serializer.is_valid():
-        for sub_data in serializer.validated_data:
-            sub_id = sub_data.get('id')
-            new_value = sub_data.get('sub_title')
+        items = serializer.validated_data
 
-            try:
-                manda_sub = MandaSub.objects.get(id=sub_id, main_id__user=user)
-            except MandaSub.DoesNotExist:
-                return Response(f"MandaSub with ID {sub_id} does not exist for the current user.", status=status.HTTP_404_NOT_FOUND)
-            
-            if 'success' in sub_data:
-                new_success = sub_data.get('success')
-                manda_sub.success = new_success
+        with transaction.atomic():
+            # 요청한 id 전체의 소유권을 쿼리 한 번으로 확인
+            manda_subs = MandaSub.objects.select_for_update(of=('self',)).filter(
+                id__in=[item['id'] for item in items], main_id__user=user
+            ).in_bulk()
+
+            for item in items:
+                if item['id'] not in manda_subs:
+                    return Response(f"MandaSub with ID {item['id']} does not exist for the current user.", status=status.HTTP_404_NOT_FOUND)
 
-            manda_sub.sub_title = new_value
-            manda_sub.save()
+            # 성공 여부는 실천목표에서 집계하므로 제목만 반영
+            bulk_update_changed(MandaSub, manda_subs, items, ('sub_title',))
 
         return Response(serializer.data, status=status.HTTP_200_OK)
     else:
@@ -147,26 +162,53 @@ def update_manda_contents(request):
     serializer = MandaContentUpdateSerializer(data=data.get('contents', []), many=True)
 
     if serializer.is_valid():
-        for content_data in serializer.validated_data:
-            content_id = content_data.get('id')
-            new_value = content_data.get('content')
-
-            try:
-                manda_content = MandaContent.objects.get(id=content_id, sub_id__main_id__user=user)
-            except MandaContent.DoesNotExist:
-                return Response(f"MandaContent with ID {content_id} does not exist for the current user.", status=status.HTTP_404_NOT_FOUND)
-
-            if 'success_count' in content_data:
-                new_success_count = content_data.get('success_count')
-                manda_content.success_count = new_success_count
-
-            manda_content.content = new_value
-            manda_content.save()
+        items = serializer.validated_data
+
+        with transaction.atomic():
+            # 요청한 id 전체의 소유권을 쿼리 한 번으로 확인
+            manda_contents = MandaContent.objects.select_for_update(of=('self',)).select_related('sub_id').filter(
+                id__in=[item['id'] for item in items], sub_id__main_id__user=user
+            ).in_bulk()
+
+            for item in items:
+                if item['id'] not in manda_contents:
+                    return Response(f"MandaContent with ID {item['id']} does not exist for the current user.", status=status.HTTP_404_NOT_FOUND)
+
+            # 바뀐 실천 횟수만큼 세부목표 / 핵심목표 / 프로필 누적값과 실천 기록(스트릭)도 같은 트랜잭션에서 갱신
+            old_counts = {pk: content.success_count for pk, content in manda_contents.items()}
+            changed = bulk_update_changed(MandaContent, manda_contents, items, ('content', 'success_count'))
+            changes = [
+                (content, old_counts[content.id], content.success_count) for content in changed
+                if content.success_count != old_counts[content.id]
+            ]
+            apply_progress(user.id, changes)
+            log_practice(user.id, changes)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
     else:
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@swagger_auto_schema(
+    method='post',
+    manual_parameters=[
+        openapi.Parameter('content_id', openapi.IN_PATH, description='MandaContent ID', type=openapi.TYPE_INTEGER),
+    ]
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def check_in_content(request, content_id):
+    # 실천 1회 기록 (절대값 대신 증가분으로 반영하므로 여러 기기에서 동시에 체크인해도 유실 없음)
+    user = request.user
+    manda_content = check_in(user.id, content_id)
+    if manda_content is None:
+        return Response(f"MandaContent with ID {content_id} does not exist for the current user.", status=status.HTTP_404_NOT_FOUND)
+
+    return Response({
+        'id': manda_content.id,
+        'success_count': manda_content.success_count,
+        'streak': practice_streak(user.id),
+    }, status=status.HTTP_200_OK)
+
 @swagger_auto_schema(
     method='delete',
     manual_parameters=[
@@ -177,77 +219,155 @@ def update_manda_contents(request):
 @permission_classes([IsAuthenticated])
 def manda_main_delete(request, manda_id):
     user = request.user
-    manda_main = get_object_or_404(MandaMain, id=manda_id, user=user)
-    manda_main.delete()
+    with transaction.atomic():
+        # 잠근 뒤 다시 읽어서 그 사이 반영된 실천 횟수까지 프로필에서 뺀다 (동시에 삭제해도 한 번만 반영)
+        manda_main = MandaMain.objects.select_for_update().filter(id=manda_id, user=user).first()
+        if manda_main is None:
+            return Response(f"MandaMain with ID {manda_id} does not exist.", status=status.HTTP_404_NOT_FOUND)
+        # 만다라트와 함께 지워지는 피드의 이미지 참조와 히트맵 활동 수를 내린다
+        feeds = Feed.objects.filter(main_id=manda_main)
+        release_images(*feeds.values_list('feed_image', flat=True))
+        remove_feeds_activity(feeds)
+        manda_main.delete()
+        remove_main_progress(manda_main)
     return Response({'message': 'MandaMain deleted successfully.'}, status=status.HTTP_204_NO_CONTENT)
 
+def build_manda_grid(manda_contents):
+    # select_related 로 가져온 MandaContent 목록에서 main / subs / contents 를 구성
+    manda_main = None
+    subs = {}
+    contents = {}
+    for manda_content in manda_contents:
+        sub = manda_content.sub_id
+        manda_main = sub.main_id
+        if sub.id not in subs:
+            subs[sub.id] = sub
+            contents[sub.id] = []
+        contents[sub.id].append(manda_content)
+    return manda_main, list(subs.values()), contents
+
+def manda_grid_response(manda_main, subs, contents):
+    return {
+        'main': {
+            'id': manda_main.id,
+            'user': manda_main.user_id,
+            'success': manda_main.success,
+            'main_title': manda_main.main_title,
+        },
+        'subs': [
+            {'id': sub.id, 'main_id': manda_main.id, 'success': sub.success, 'sub_title': sub.sub_title}
+            for sub in subs
+        ],
+        'contents': [
+            {'id': c.id, 'sub_id': sub.id, 'success_count': c.success_count, 'content': c.content}
+            for sub in subs for c in contents[sub.id]
+        ],
+    }
+
+def manda_grid_compact_response(manda_main, subs, contents):
+    # subs[i] 와 contents 의 i 번째 행이 같은 세부목표를 가리킨다
+    return {
+        'main': {
+            'id': manda_main.id,
+            'user': manda_main.user_id,
+            'success': manda_main.success,
+            'main_title': manda_main.main_title,
+        },
+        'subs': {
+            'id': [sub.id for sub in subs],
+            'success': [sub.success for sub in subs],
+            'sub_title': [sub.sub_title for sub in subs],
+        },
+        'contents': {
+            'id': [[c.id for c in contents[sub.id]] for sub in subs],
+            'success_count': [[c.success_count for c in contents[sub.id]] for sub in subs],
+            'content': [[c.content for c in contents[sub.id]] for sub in subs],
+        },
+    }
+
 @swagger_auto_schema(
     method='get',
     manual_parameters=[
         openapi.Parameter('manda_id', openapi.IN_PATH, description='Manda ID', type=openapi.TYPE_INTEGER),
+        openapi.Parameter('compact', openapi.IN_QUERY, description='위치 기반 배열 형식으로 응답', type=openapi.TYPE_BOOLEAN),
     ]
 )
 @api_view(['GET'])
 def select_mandalart(request, manda_id):
-    manda_main = MandaMain.objects.get(id=manda_id)
-    manda_main_serializer = MandaMainViewSerializer(manda_main)
-    
-    manda_sub_objects = MandaSub.objects.filter(main_id=manda_main)
-    manda_sub_serializer = MandaSubSerializer(manda_sub_objects, many=True)
+    # main, sub, content 를 JOIN 한 쿼리 한 번으로 조회
+    manda_contents = MandaContent.objects.filter(
+        sub_id__main_id=manda_id
+    ).select_related('sub_id__main_id').order_by('sub_id', 'id')
 
-    manda_content_objects = MandaContent.objects.filter(sub_id__in=manda_sub_objects)
-    manda_content_serializer = MandaContentSerializer(manda_content_objects, many=True)
+    manda_main, subs, contents = build_manda_grid(manda_contents)
+    if manda_main is None:
+        return Response(f"MandaMain with ID {manda_id} does not exist.", status=status.HTTP_404_NOT_FOUND)
 
-    response_data = {
-        'main': manda_main_serializer.data,
-        'subs': manda_sub_serializer.data,
-        'contents': manda_content_serializer.data
-    }
-
-    return Response(response_data, status=status.HTTP_200_OK)
+    if request.query_params.get('compact') in ('1', 'true'):
+        return Response(manda_grid_compact_response(manda_main, subs, contents), status=status.HTTP_200_OK)
+    return Response(manda_grid_response(manda_main, subs, contents), status=status.HTTP_200_OK)
 
+@swagger_auto_schema(method='get', manual_parameters=pagination_parameters)
 @api_view(['GET'])
 def manda_main_list(request, user_id):
     try:
         user = User.objects.get(pk=user_id)
     except User.DoesNotExist:
         return Response(f"해당 유저가 존재하지 않습니다.", status=status.HTTP_404_NOT_FOUND)
-    manda_main_objects = MandaMain.objects.filter(user=user)
+    manda_main_objects, next_cursor = KeysetPaginator(ordering=('id',)).paginate(request, MandaMain.objects.filter(user=user))
     serializer = MandaMainSerializer(manda_main_objects, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return Response({'mandas': serializer.data, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
 
+@swagger_auto_schema(method='get', manual_parameters=pagination_parameters)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def others_manda_main_list(request):
     user = request.user
 
-    manda_main = MandaMain.objects.exclude(user=user)
-    manda_data = {}
-    
-    for main in manda_main:
-        main_entry = {
+    # id 내림차순 keyset 페이지네이션 (OFFSET 없이 다음 페이지 조회)
+    manda_main = MandaMain.objects.exclude(user=user).prefetch_related('mandasub_set')
+    page, next_cursor = KeysetPaginator(ordering=('-id',), max_page_size=50).paginate(request, manda_main)
+
+    manda_data = [
+        {
             'id': main.id,
+            'user_id': main.user_id,
             'success': main.success,
             'main_title': main.main_title,
-            'subs': []
+            'subs': [
+                {'id': sub.id, 'success': sub.success, 'sub_title': sub.sub_title}
+                for sub in main.mandasub_set.all()
+            ]
         }
-        
-        manda_subs = MandaSub.objects.filter(main_id=main)
-        for sub in manda_subs:
-            sub_entry = {
-                'id': sub.id,
-                'success': sub.success,
-                'sub_title': sub.sub_title
-            }
-            main_entry['subs'].append(sub_entry)
-
-        user_id = main.user.id
-        if user_id in manda_data:
-            manda_data[user_id].append(main_entry)
-        else:
-            manda_data[user_id] = [main_entry]
-
-    return Response(manda_data, status=status.HTTP_200_OK)
+        for main in page
+    ]
+
+    return Response({'mandas': manda_data, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
+
+@swagger_auto_schema(
+    method='get',
+    manual_parameters=[
+        openapi.Parameter('manda_id', openapi.IN_PATH, description='Manda ID', type=openapi.TYPE_INTEGER),
+    ]
+)
+@api_view(['GET'])
+def manda_progress(request, manda_id):
+    # 누적값만 읽는다 (실천목표를 다시 집계하지 않음)
+    manda_subs = list(MandaSub.objects.filter(main_id=manda_id).select_related('main_id'))
+    if not manda_subs:
+        return Response(f"MandaMain with ID {manda_id} does not exist.", status=status.HTTP_404_NOT_FOUND)
+
+    manda_main = manda_subs[0].main_id
+    return Response({
+        'id': manda_main.id,
+        'success': manda_main.success,
+        'success_total': manda_main.success_total,
+        'done_contents': manda_main.done_contents,
+        'subs': [
+            {'id': sub.id, 'success': sub.success, 'success_total': sub.success_total, 'done_contents': sub.done_contents}
+            for sub in manda_subs
+        ],
+    }, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 def manda_main_sub(request, manda_id):
@@ -0,0 +1,139 @@
+import uuid
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.decorators import api_view, permission_classes, authentication_classes
+from rest_framework.permissions import IsAuthenticated, AllowAny
+from drf_yasg.utils import swagger_auto_schema
+from ..models import UserProfile, Feed, UsedUploadToken
+from ..serializers.upload_serializer import PresignUploadSerializer, FinalizeUploadSerializer
+from ..image_processing import InvalidImage
+from ..profile_cache import invalidate_profile
+from ..progress import user_success_total
+from ..image_uploader import (
+    S3ImgUploader, UploadRejected, get_storage, acquire_images, release_images,
+    IMAGE_UPLOAD_MAX_SIZE, IMAGE_PRESIGN_EXPIRES,
+)
+
+UPLOAD_TOKEN_SALT = 'manda_app.direct_upload'
+# 업로드 주소 발급 후 finalize 까지 허용하는 시간(초)
+UPLOAD_TOKEN_MAX_AGE = IMAGE_PRESIGN_EXPIRES * 2
+
+# 이미지 직접 업로드 주소 발급 (파일은 Django 를 거치지 않고 저장소로 바로 올린다)
+@swagger_auto_schema(method='post', request_body=PresignUploadSerializer)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def presign_upload(request):
+    serializer = PresignUploadSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    key = 'uploads/' + uuid.uuid4().hex
+    target = get_storage().presign(key, serializer.validated_data['content_type'], IMAGE_UPLOAD_MAX_SIZE, IMAGE_PRESIGN_EXPIRES)
+    upload_token = signing.dumps({
+        'key': key,
+        'user': request.user.id,
+        'purpose': serializer.validated_data['purpose'],
+    }, salt=UPLOAD_TOKEN_SALT)
+
+    return Response({
+        'upload_token': upload_token,
+        'url': target['url'],
+        'fields': target['fields'],
+        'expires_in': IMAGE_PRESIGN_EXPIRES,
+    }, status=status.HTTP_200_OK)
+
+# 업로드가 끝난 이미지를 확인하고 프로필 / 피드에 반영
+@swagger_auto_schema(method='post', request_body=FinalizeUploadSerializer)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalize_upload(request):
+    serializer = FinalizeUploadSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        upload = signing.loads(serializer.validated_data['upload_token'], salt=UPLOAD_TOKEN_SALT, max_age=UPLOAD_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return Response({'error': 'Invalid or expired upload token.'}, status=status.HTTP_400_BAD_REQUEST)
+    if upload['user'] != request.user.id:
+        return Response({'error': 'Upload belongs to another user.'}, status=status.HTTP_403_FORBIDDEN)
+
+    feed = None
+    if upload['purpose'] == 'feed':
+        if 'feed_id' not in serializer.validated_data:
+            return Response({'error': 'feed_id is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        feed = get_object_or_404(Feed, id=serializer.validated_data['feed_id'])
+        if feed.user_id != request.user.id:
+            return Response({'error': 'You can only edit your own feed.'}, status=status.HTTP_403_FORBIDDEN)
+
+    # 작업 전에 토큰을 사용 처리한다 (key 가 유일하므로 여러 워커에서 동시에 보낸 요청 중 하나만 통과)
+    key = upload['key']
+    try:
+        with transaction.atomic():
+            UsedUploadToken.objects.create(key=key)
+    except IntegrityError:
+        return Response({'error': 'Upload token has already been used.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # 임시 key 의 객체를 검증 / 변형 이미지로 저장한 뒤 임시 객체는 지운다
+    storage = get_storage()
+    size = storage.size(key)
+    if size is None:
+        # 아직 업로드가 끝나지 않은 경우 같은 토큰으로 다시 시도할 수 있게 둔다
+        UsedUploadToken.objects.filter(key=key).delete()
+        return Response({'error': 'Upload not found.'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        if size > IMAGE_UPLOAD_MAX_SIZE:
+            return Response({'error': 'Image is too large.'}, status=status.HTTP_400_BAD_REQUEST)
+        fileobj = storage.open(key)
+        try:
+            variants = S3ImgUploader(fileobj).upload_variants()
+        finally:
+            fileobj.close()
+    except InvalidImage as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    finally:
+        storage.delete(key)
+
+    # 새 이미지 참조 / 이전 이미지 해제를 저장과 같은 트랜잭션에서 처리
+    with transaction.atomic():
+        if feed is not None:
+            old_image = feed.feed_image.name
+            feed.feed_image = variants['original']
+            feed.feed_image_variants = variants
+            feed.save(update_fields=['feed_image', 'feed_image_variants', 'updated_at'])
+        else:
+            user_profile, _ = UserProfile.objects.get_or_create(
+                user=request.user, defaults={'success_count': user_success_total(request.user.id)}
+            )
+            old_image = user_profile.user_image
+            user_profile.user_image = variants['original']
+            user_profile.user_image_variants = variants
+            user_profile.save(update_fields=['user_image', 'user_image_variants'])
+        acquire_images(variants['original'])
+        release_images(old_image)
+    if feed is None:
+        invalidate_profile(request.user.id)
+
+    return Response({'variants': variants}, status=status.HTTP_200_OK)
+
+# 로컬 / 테스트용 업로드 서버 (S3 presigned POST 대신 사용)
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def local_storage_upload(request):
+    storage = get_storage()
+    if not hasattr(storage, 'accept_upload'):
+        return Response({'error': 'Local uploads are disabled.'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        storage.accept_upload(
+            request.data.get('policy'),
+            request.data.get('key'),
+            request.data.get('Content-Type'),
+            request.FILES.get('file'),
+        )
+    except UploadRejected as e:
+        return Response({'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+    return Response(status=status.HTTP_204_NO_CONTENT)
@@ -1,5 +1,6 @@
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
@@ -13,12 +14,19 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
 from ..serializers.user_serializer import UserSerializer, UserAuthenticationSerializer, UserProfileSerializer
 from .utils import generate_temp_password, send_temp_password_email
-from ..models import UserProfile
-from ..image_uploader import S3ImgUploader
+from ..models import UserProfile, Feed
+from ..image_uploader import S3ImgUploader, acquire_images, release_images
+from ..image_processing import InvalidImage, get_image_width
+from ..profile_cache import get_profile, get_profiles, render_profile, invalidate_profile
+from ..progress import user_success_total
+from django.conf import settings
 
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
+# 한 번에 조회할 수 있는 최대 프로필 수
+PROFILE_BATCH_LIMIT = getattr(settings, 'PROFILE_BATCH_LIMIT', 50)
+
 @swagger_auto_schema(method='post', request_body=UserAuthenticationSerializer)
 @api_view(['POST'])
 def user_login(request):
@@ -64,6 +72,7 @@ def user_edit(request):
             password = make_password(serializer.validated_data['password'])
             serializer.validated_data['password'] = password
         serializer.save()
+        invalidate_profile(user.id)
         return Response(serializer.data, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -97,7 +106,15 @@ def reset_password(request):
 @api_view(['DELETE'])
 def delete_user(request):
     user = request.user
-    user.delete()
+    user_id = user.id
+    with transaction.atomic():
+        # 유저와 함께 지워지는 프로필 / 피드 이미지의 참조를 내린다
+        release_images(
+            *UserProfile.objects.filter(user=user).values_list('user_image', flat=True),
+            *Feed.objects.filter(user=user).values_list('feed_image', flat=True),
+        )
+        user.delete()
+    invalidate_profile(user_id)
     return JsonResponse({'message': 'User deleted successfully.'})
 
 @swagger_auto_schema(method='post', request_body=UserProfileSerializer)
@@ -105,37 +122,63 @@ def delete_user(request):
 def write_profile(request):
     serializer = UserProfileSerializer(data=request.data)
     if serializer.is_valid():
-        image_file = request.FILES['user_img']
-        url = S3ImgUploader(image_file).upload()
-        user_profile = UserProfile.objects.create(
-            user=User.objects.get(pk=request.data['user']),
-            user_image=url,
-            user_position=serializer.validated_data.get('user_position'),
-            user_info=serializer.validated_data.get('user_info'),
-            user_hash=serializer.validated_data.get('user_hash'),
-            success_count=serializer.validated_data.get('success_count')
-        )
+        # 이미지는 파일로 함께 올리거나 upload/presign -> upload/finalize 로 따로 올린다
+        variants = {}
+        if 'user_img' in request.FILES:
+            try:
+                variants = S3ImgUploader(request.FILES['user_img']).upload_variants()
+            except InvalidImage as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            user = User.objects.get(pk=request.data['user'])
+            user_profile = UserProfile.objects.create(
+                user=user,
+                user_image=variants.get('original', ''),
+                user_image_variants=variants,
+                user_position=serializer.validated_data.get('user_position'),
+                user_info=serializer.validated_data.get('user_info'),
+                user_hash=serializer.validated_data.get('user_hash'),
+                success_count=user_success_total(user.id),
+            )
+            acquire_images(user_profile.user_image)
+        invalidate_profile(user_profile.user_id)
         response_serializer = UserProfileSerializer(user_profile)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@swagger_auto_schema(method='get', manual_parameters=[
+    openapi.Parameter('width', openapi.IN_QUERY, description="표시할 이미지 너비(px)", type=openapi.TYPE_INTEGER),
+])
 @api_view(['GET'])
 def view_profile(request, user_id):
-    user = User.objects.get(pk=user_id)
-    user_profile = UserProfile.objects.get(user=user)
-    object_key = user_profile.user_image
-    url = f'https://d3u19o4soz3vn3.cloudfront.net/img/{object_key}'
+    # 캐시된 프로필을 읽고 ?width= 에 맞는 가장 작은 변형 이미지를 고른다 (변형이 없는 예전 이미지는 원본)
+    profile = get_profile(user_id)
+    if profile is None:
+        return Response({'error': 'Profile does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(render_profile(profile, get_image_width(request)), status=status.HTTP_200_OK)
+
+@swagger_auto_schema(method='get', manual_parameters=[
+    openapi.Parameter('ids', openapi.IN_QUERY, description="쉼표로 구분한 user_id 목록", type=openapi.TYPE_STRING, required=True),
+    openapi.Parameter('width', openapi.IN_QUERY, description="표시할 이미지 너비(px)", type=openapi.TYPE_INTEGER),
+])
+@api_view(['GET'])
+def view_profiles(request):
+    # 목록 화면에 보이는 작성자들의 프로필을 한 번에 조회 (캐시에 없는 것만 쿼리 한 번으로 조회)
+    try:
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in request.query_params.get('ids', '').split(',') if user_id))
+    except ValueError:
+        return Response({'error': 'ids must be comma separated integers.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not user_ids:
+        return Response({'error': 'ids is required.'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(user_ids) > PROFILE_BATCH_LIMIT:
+        return Response({'error': f'Up to {PROFILE_BATCH_LIMIT} ids are allowed.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    response_data = {
-        'user_id': user_id,
-        'username': user.username,
-        'user_img': url,
-        'user_position': user_profile.user_position,
-        'user_info': user_profile.user_info,
-        'user_hash': user_profile.user_hash,
-        'success_count': user_profile.success_count
-    }
-    return Response(response_data, status=status.HTTP_200_OK)
+    profiles = get_profiles(user_ids)
+    width = get_image_width(request)
+    return Response({
+        'profiles': [render_profile(profiles[user_id], width) for user_id in user_ids if user_id in profiles],
+        'missing': [user_id for user_id in user_ids if user_id not in profiles],
+    }, status=status.HTTP_200_OK)
 
 @swagger_auto_schema(method='patch', request_body=UserProfileSerializer)
 @api_view(['PATCH'])
@@ -143,9 +186,21 @@ def edit_profile(request):
     user_profile = get_object_or_404(UserProfile, user=request.data.get('user'))
     serializer = UserProfileSerializer(user_profile, data=request.data, partial=True)
     if serializer.is_valid():
-        if 'user_img' in request.data:
-            url = S3ImgUploader(request.FILES['user_img'])
-            serializer.user_img = url.upload()
-        serializer.save()
+        if 'user_img' in request.FILES:
+            try:
+                variants = S3ImgUploader(request.FILES['user_img']).upload_variants()
+            except InvalidImage as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            serializer.validated_data['user_image'] = variants['original']
+            serializer.validated_data['user_image_variants'] = variants
+            # 새 이미지 참조 / 이전 이미지 해제를 저장과 같은 트랜잭션에서 처리 (실제 삭제는 GC 에서)
+            old_image = user_profile.user_image
+            with transaction.atomic():
+                serializer.save()
+                acquire_images(variants['original'])
+                release_images(old_image)
+        else:
+            serializer.save()
+        invalidate_profile(user_profile.user_id)
         return Response(serializer.data, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
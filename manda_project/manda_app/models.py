@@ -1,7 +1,9 @@
-from django.db import models
+import uuid
+from django.db import models, transaction
 from django.contrib.auth.models import User  # User 모델을 가져오기
 from django.http import JsonResponse #
-from django.db.models import JSONField
+from django.db.models import JSONField, Case, When, F, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 # Create your models here.
 
@@ -9,6 +11,7 @@ from django.db.models import JSONField
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile') 
     user_image = models.CharField(max_length=255, verbose_name="유저 프로필 이미지")
+    user_image_variants = JSONField(default=dict, blank=True, verbose_name="크기별 프로필 이미지 key")
     user_position = models.CharField(max_length=255, verbose_name="유저가 속한 그룹", null=True)
     user_info = models.CharField(max_length=255, verbose_name="유저가 작성한 프로필 설명", null=True)
     user_hash = models.CharField(max_length=255, verbose_name="해시태그", null=True)
@@ -25,6 +28,8 @@ class MandaMain(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)  # 외래키로 User 모델 연결
     success = models.BooleanField(default=False)  # 성공 여부 (True/False)
     main_title = models.CharField(max_length=100)  # 메인 타이틀, 필요에 따라 길이 조절 가능
+    success_total = models.BigIntegerField(default=0)  # 실천목표 실천 횟수 합계 (progress.py 에서 갱신)
+    done_contents = models.IntegerField(default=0)  # 완료한 실천목표 수 (0 ~ 64)
 
     class Meta:
         ordering = ['id']
@@ -33,23 +38,30 @@ class MandaMain(models.Model):
         return self.main_title
     
     def save(self, *args, **kwargs):
-        super(MandaMain, self).save(*args, **kwargs)
+        # 최초 생성 시에만 8x8 그리드를 만든다 (이후 save 에서는 재생성하지 않음)
+        is_new = self._state.adding
+        with transaction.atomic():
+            super(MandaMain, self).save(*args, **kwargs)
+            if is_new:
+                self.build_grid()
 
-        # MandaSub 객체 생성
-        for _ in range(8):
-            MandaSub.objects.create(main_id=self)
-
-        # MandaContent 객체 생성
-        sub_instances = MandaSub.objects.filter(main_id=self)
-        for sub_instance in sub_instances:
-            for _ in range(8):
-                MandaContent.objects.create(sub_id=sub_instance)
+    def build_grid(self):
+        # MandaSub 8개, MandaContent 64개를 각각 bulk_create 한 번으로 생성
+        subs = MandaSub.objects.bulk_create([MandaSub(main_id=self) for _ in range(8)])
+        contents = MandaContent.objects.bulk_create([
+            MandaContent(sub_id=sub) for sub in subs for _ in range(8)
+        ])
+        self.grid_subs = subs
+        self.grid_contents = contents
+        return subs, contents
 
 #세부목표
 class MandaSub(models.Model):
     main_id = models.ForeignKey(MandaMain, on_delete=models.CASCADE)  # MandaMain 모델과 외래키로 연결
     success = models.BooleanField(default=False)  # 성공 여부 (True/False)
     sub_title = models.CharField(max_length=100, null=True)  # 서브 타이틀, 최대 길이 50
+    success_total = models.BigIntegerField(default=0)  # 실천목표 실천 횟수 합계 (progress.py 에서 갱신)
+    done_contents = models.IntegerField(default=0)  # 완료한 실천목표 수 (0 ~ 8)
 
     class Meta:
         ordering = ['id']
@@ -68,6 +80,19 @@ class MandaContent(models.Model):
         
     def __str__(self):
         return self.content
+
+#실천 기록 (체크인 한 번에 한 행만 추가, 스트릭 / 히트맵은 날짜 범위로 조회)
+class PracticeLog(models.Model):
+    content = models.ForeignKey(MandaContent, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=1, verbose_name="이 기록으로 늘어난 실천 횟수")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'day']),
+            models.Index(fields=['content', 'day']),
+        ]
     
 #Feed 테이블
 class Feed(models.Model):
@@ -77,14 +102,36 @@ class Feed(models.Model):
     sub_id = models.ForeignKey(MandaSub, on_delete=models.CASCADE)  # sub_id 외래 키
     feed_contents = models.TextField()  # 피드 내용
     feed_image = models.ImageField(upload_to='feed_images/')  # 이미지를 저장할 경로
+    feed_image_variants = JSONField(default=dict, blank=True)  # 크기별 이미지 key (original / feed / thumb)
     created_at = models.DateTimeField(auto_now_add=True)  # 피드 생성일
     updated_at = models.DateTimeField(auto_now=True)  # 피드 업데이트일
     feed_hash = models.CharField(max_length=255)  # 피드 해시값, 필요에 따라 길이 조절 가능
-    emoji_count = JSONField(blank=True, null=True, default=dict)
 
     def __str__(self):
         return self.feed_contents
 
+#타임라인 (작성 시점에 팔로워에게 피드 id 를 미리 넣어두는 인덱스)
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries', verbose_name="타임라인 주인")
+    feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('user', 'feed')
+
+#팔로워가 많아 팬아웃 대신 읽기 시점에 조회하는 작성자
+class PullAuthor(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    since_feed_id = models.IntegerField(null=True, verbose_name="이 피드부터 팬아웃하지 않음")
+
+#유저별 하루 활동 수 (피드 작성 / 삭제 시 증감, 히트맵은 이 테이블만 조회)
+class DailyActivity(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_activities')
+    day = models.DateField()
+    feed_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'day')
+
 #댓글
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -99,6 +146,19 @@ class Reaction(models.Model):
     feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
     emoji_name = models.CharField(max_length=50)
 
+    class Meta:
+        unique_together = ('user', 'feed', 'emoji_name')
+
+#반응 수 (한 행에 락이 몰리지 않도록 shard 로 나눠서 누적)
+class FeedEmojiCounter(models.Model):
+    feed = models.ForeignKey(Feed, on_delete=models.CASCADE, related_name='emoji_counters')
+    emoji_name = models.CharField(max_length=50)
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('feed', 'emoji_name', 'shard')
+
 #알람(댓글, 좋아요, 팔로우)
 class Alarm(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_alarms', verbose_name="알람을 보낸 유저")
@@ -115,24 +175,107 @@ class ChatRoom(models.Model):
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_chats', null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     latest_message_time = models.DateTimeField(null=True, blank=True)
+    latest_message = models.CharField(max_length=100, blank=True, default='', verbose_name="마지막 메시지 미리보기")
+    starter_unread_count = models.IntegerField(default=0, verbose_name="starter 가 안 읽은 메시지 수")
+    receiver_unread_count = models.IntegerField(default=0, verbose_name="receiver 가 안 읽은 메시지 수")
+    starter_last_read_id = models.BigIntegerField(default=0, verbose_name="starter 가 마지막으로 읽은 메시지 id")
+    receiver_last_read_id = models.BigIntegerField(default=0, verbose_name="receiver 가 마지막으로 읽은 메시지 id")
+    last_seq = models.BigIntegerField(default=0, verbose_name="마지막으로 발급한 메시지 순번")
 
     def __str__(self):
         return f'ChatRoom: {self.starter.username} and {self.receiver.username}'
 
+    def last_read_field(self, user_id):
+        return 'starter_last_read_id' if self.starter_id == user_id else 'receiver_last_read_id'
+
+    def mark_read(self, user_id, message_id):
+        # 읽은 위치(watermark)를 앞으로만 옮기고, 안 읽은 수는 watermark 이후 상대 메시지 수로 다시 계산
+        last_read_field = self.last_read_field(user_id)
+        unread_field = 'starter_unread_count' if self.starter_id == user_id else 'receiver_unread_count'
+        unread_messages = ChatMessage.objects.filter(
+            chatroom=OuterRef('pk'), id__gt=message_id
+        ).exclude(author=user_id).order_by().values('chatroom').annotate(count=Count('id')).values('count')
+
+        return ChatRoom.objects.filter(pk=self.pk, **{f'{last_read_field}__lt': message_id}).update(**{
+            last_read_field: message_id,
+            unread_field: Coalesce(Subquery(unread_messages, output_field=models.IntegerField()), 0),
+        })
+
+    def backfill_seq(self):
+        # 순번 도입 전에 저장된(seq 가 없는) 메시지가 있으면 채팅방 전체를 (created_at, id) 순으로 다시 번호 매긴다
+        with transaction.atomic():
+            ChatRoom.objects.select_for_update().filter(pk=self.pk).values_list('pk', flat=True).get()
+            if not self.messages.filter(seq__isnull=True).exists():
+                return 0
+
+            chat_messages = list(self.messages.order_by('created_at', 'id').only('id'))
+            # (chatroom, seq) 유일 조건과 겹치지 않도록 먼저 비운 뒤 다시 채운다
+            self.messages.update(seq=None)
+            for seq, chat_msg in enumerate(chat_messages, 1):
+                chat_msg.seq = seq
+            ChatMessage.objects.bulk_update(chat_messages, ['seq'], batch_size=1000)
+
+            self.last_seq = len(chat_messages)
+            ChatRoom.objects.filter(pk=self.pk).update(last_seq=self.last_seq)
+        return len(chat_messages)
+
 class ChatMessage(models.Model):
     chatroom = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='authored_messages')
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
+    is_read = models.BooleanField(default=False)  # 사용하지 않음: 읽음 여부는 채팅방의 참여자별 watermark 로 계산
+    chat_uuid = models.UUIDField(default=uuid.uuid4, unique=True, verbose_name="클라이언트가 생성한 메시지 id")
+    seq = models.BigIntegerField(null=True, verbose_name="채팅방 안에서의 메시지 순번")
 
     def __str__(self):
         return f'Message: {self.author.username} at {self.created_at}'
 
     class Meta:
         ordering = ['created_at']
+        unique_together = ('chatroom', 'seq')
+        indexes = [
+            models.Index(fields=['chatroom', '-created_at']),
+        ]
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.chatroom.latest_message_time = self.created_at
-        self.chatroom.save()
\ No newline at end of file
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            # 채팅방 행을 잠그고 다음 순번을 발급
+            last_seq = ChatRoom.objects.select_for_update().filter(pk=self.chatroom_id).values_list('last_seq', flat=True).get()
+            self.seq = last_seq + 1
+            super().save(*args, **kwargs)
+
+            # 채팅방 전체를 다시 저장하지 않고 필요한 컬럼만 UPDATE 한 번으로 갱신
+            ChatRoom.objects.filter(pk=self.chatroom_id).update(
+                last_seq=self.seq,
+                latest_message_time=self.created_at,
+                latest_message=self.content[:100],
+                starter_unread_count=Case(
+                    When(starter_id=self.author_id, then=F('starter_unread_count')),
+                    default=F('starter_unread_count') + 1,
+                ),
+                receiver_unread_count=Case(
+                    When(starter_id=self.author_id, then=F('receiver_unread_count') + 1),
+                    default=F('receiver_unread_count'),
+                ),
+            )
+#업로드 이미지 (내용 해시로 저장하고 참조 수가 0 이 되면 GC 대상)
+class StoredImage(models.Model):
+    digest = models.CharField(max_length=64, primary_key=True, verbose_name="원본 파일 sha256")
+    variants = JSONField(default=dict, verbose_name="크기별 이미지 key")
+    ref_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['ref_count', 'updated_at'])]
+
+#사용한 직접 업로드 토큰 (finalize 는 토큰당 한 번만. 만료된 행은 gc_images 에서 정리)
+class UsedUploadToken(models.Model):
+    key = models.CharField(max_length=64, primary_key=True, verbose_name="업로드 임시 key")
+    used_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['used_at'])]
@@ -0,0 +1,78 @@
+import base64
+import json
+from datetime import datetime
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from drf_yasg import openapi
+
+DEFAULT_PAGE_SIZE = getattr(settings, 'PAGINATION_PAGE_SIZE', 20)
+MAX_PAGE_SIZE = getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 100)
+
+pagination_parameters = [
+    openapi.Parameter('cursor', openapi.IN_QUERY, description='이전 응답의 next_cursor', type=openapi.TYPE_STRING),
+    openapi.Parameter('size', openapi.IN_QUERY, description='페이지 크기', type=openapi.TYPE_INTEGER),
+]
+
+def encode_cursor(values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    # 잘못된 커서는 None 으로 처리 (첫 페이지)
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+def get_page_size(request, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try:
+        size = int(request.query_params.get('size', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, maximum))
+
+class KeysetPaginator:
+    """
+    OFFSET 없이 정렬 키 (예: ('-created_at', '-id')) 기준으로 다음 페이지를 조회한다.
+    마지막 정렬 키는 유일해야 한다.
+    """
+    def __init__(self, ordering=('-id',), page_size=DEFAULT_PAGE_SIZE, max_page_size=MAX_PAGE_SIZE):
+        self.ordering = ordering
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+
+    def cursor_filter(self, values):
+        # (a, b) < (x, y)  =>  a < x OR (a = x AND b < y)
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate(self, request, queryset):
+        size = get_page_size(request, self.page_size, self.max_page_size)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = decode_cursor(request.query_params.get('cursor'))
+        # cursor 값은 정렬 필드마다 하나의 스칼라 값이어야 한다 (조작된 cursor 는 무시)
+        if cursor is not None and len(cursor) == len(self.ordering) and all(
+            isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in cursor
+        ):
+            try:
+                queryset = queryset.filter(self.cursor_filter(cursor))
+            except (TypeError, ValueError, ValidationError):
+                pass
+
+        page = list(queryset[:size + 1])
+        next_cursor = None
+        if len(page) > size:
+            page = page[:size]
+            next_cursor = encode_cursor([getattr(page[-1], field.lstrip('-')) for field in self.ordering])
+        return page, next_cursor
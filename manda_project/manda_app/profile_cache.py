@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import UserProfile
+from .image_processing import pick_variant
+from .image_uploader import image_url
+
+# 캐시된 프로필 유지 시간(초)
+PROFILE_CACHE_TIMEOUT = getattr(settings, 'PROFILE_CACHE_TIMEOUT', 60 * 60)
+# 프로필 응답 형식이 바뀌면 올려서 이전 형식의 캐시를 무시한다
+PROFILE_CACHE_SCHEMA = 1
+
+def version_key(user_id):
+    return f'profile_version:{user_id}'
+
+def payload_key(user_id, version):
+    return f'profile:{PROFILE_CACHE_SCHEMA}:{user_id}:{version}'
+
+def build_profile_payload(user_profile):
+    # user_profile 은 select_related('user') 로 조회한 것
+    variants = {name: image_url(key) for name, key in user_profile.user_image_variants.items()}
+    return {
+        'user_id': user_profile.user_id,
+        'username': user_profile.user.username,
+        'user_img': image_url(user_profile.user_image),
+        'user_img_variants': variants,
+        'user_position': user_profile.user_position,
+        'user_info': user_profile.user_info,
+        'user_hash': user_profile.user_hash,
+        'success_count': user_profile.success_count,
+    }
+
+def render_profile(payload, width=None):
+    # 캐시된 payload 에서 width 에 맞는 이미지를 골라 응답을 만든다
+    profile = dict(payload)
+    profile['user_img'] = pick_variant(payload['user_img_variants'], width) or payload['user_img']
+    return profile
+
+def get_profiles(user_ids):
+    """
+    {user_id: payload} 를 반환한다 (프로필이 없는 유저는 빠진다).
+    캐시에 있는 것은 그대로 쓰고 나머지는 select_related 쿼리 한 번으로 채운다.
+    payload key 에 유저별 버전이 들어가므로 invalidate_profile 이후에는 예전 값을 읽지 않는다.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    versions = cache.get_many([version_key(user_id) for user_id in user_ids])
+    keys = {user_id: payload_key(user_id, versions.get(version_key(user_id), 0)) for user_id in user_ids}
+
+    cached = cache.get_many(list(keys.values()))
+    profiles = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+
+    missing = [user_id for user_id in user_ids if user_id not in profiles]
+    if missing:
+        loaded = {}
+        for user_profile in UserProfile.objects.select_related('user').filter(user_id__in=missing):
+            loaded[user_profile.user_id] = build_profile_payload(user_profile)
+        cache.set_many({keys[user_id]: payload for user_id, payload in loaded.items()}, PROFILE_CACHE_TIMEOUT)
+        profiles.update(loaded)
+    return profiles
+
+def get_profile(user_id):
+    return get_profiles([user_id]).get(user_id)
+
+def invalidate_profile(user_id):
+    # 현재 버전의 캐시를 지우고 버전을 올린다 (읽는 도중이던 요청이 예전 값을 다시 써도 새 버전에는 영향 없음)
+    key = version_key(user_id)
+    cache.delete(payload_key(user_id, cache.get(key, 0)))
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+def invalidate_profile_on_commit(user_id):
+    # 트랜잭션 안에서 바꾼 값은 커밋 후에 무효화한다 (커밋 전에 읽은 예전 값이 새 버전으로 캐시되지 않도록)
+    transaction.on_commit(lambda: invalidate_profile(user_id))
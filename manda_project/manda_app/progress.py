@@ -0,0 +1,135 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, F, Q, Sum, Count, Value, BooleanField, BigIntegerField
+from django.db.models.functions import Coalesce
+from .models import MandaMain, MandaSub, MandaContent, UserProfile, PracticeLog
+from .profile_cache import invalidate_profile_on_commit
+
+# 실천목표를 이 횟수 이상 실천하면 완료로 본다
+CONTENT_GOAL = getattr(settings, 'MANDA_CONTENT_GOAL', 1)
+CONTENTS_PER_SUB = 8
+CONTENTS_PER_MAIN = 64
+# 실천목표 하나의 최대 실천 횟수 (클라이언트가 수정할 수 있는 범위)
+MAX_SUCCESS_COUNT = getattr(settings, 'MANDA_MAX_SUCCESS_COUNT', 10000)
+# 스트릭 계산 시 조회하는 최대 일수
+STREAK_LIMIT = getattr(settings, 'MANDA_STREAK_LIMIT', 366)
+
+def is_done(success_count):
+    return success_count >= CONTENT_GOAL
+
+def apply_progress(user_id, changes):
+    """
+    실천목표 success_count 변경분을 세부목표 / 핵심목표 / 프로필 누적값에 반영한다.
+    changes: [(content, 이전 success_count, 새 success_count)] (content 는 select_related('sub_id') 로 조회)
+    호출하는 쪽의 transaction 안에서 실행해야 같은 트랜잭션으로 묶인다.
+    """
+    sub_deltas = defaultdict(lambda: [0, 0])
+    main_deltas = defaultdict(lambda: [0, 0])
+    total = 0
+    for content, old, new in changes:
+        delta = (new - old, is_done(new) - is_done(old))
+        for deltas, key in ((sub_deltas, content.sub_id_id), (main_deltas, content.sub_id.main_id_id)):
+            deltas[key][0] += delta[0]
+            deltas[key][1] += delta[1]
+        total += delta[0]
+
+    # 목표별 UPDATE 한 번. 성공 여부는 갱신 전 값 + 증가분으로 판단 (같은 UPDATE 안에서 계산)
+    for model, deltas, goal in ((MandaSub, sub_deltas, CONTENTS_PER_SUB), (MandaMain, main_deltas, CONTENTS_PER_MAIN)):
+        for pk, (success_delta, done_delta) in deltas.items():
+            if success_delta == 0 and done_delta == 0:
+                continue
+            model.objects.filter(pk=pk).update(
+                success_total=F('success_total') + success_delta,
+                done_contents=F('done_contents') + done_delta,
+                success=Case(
+                    When(done_contents__gte=goal - done_delta, then=Value(True)),
+                    default=Value(False),
+                    output_field=BooleanField(),
+                ),
+            )
+
+    if total:
+        UserProfile.objects.filter(user_id=user_id).update(success_count=F('success_count') + total)
+        invalidate_profile_on_commit(user_id)
+
+def check_in(user_id, content_id, day=None):
+    """
+    실천목표 실천 1회. success_count 는 F() 로 증가시키고 실천 기록을 한 행 추가한다.
+    누적값 갱신까지 한 트랜잭션. 유저의 실천목표가 아니면 None
+    """
+    with transaction.atomic():
+        content = MandaContent.objects.select_for_update(of=('self',)).select_related('sub_id').filter(
+            pk=content_id, sub_id__main_id__user_id=user_id
+        ).first()
+        if content is None:
+            return None
+
+        MandaContent.objects.filter(pk=content.pk).update(success_count=F('success_count') + 1)
+        old = content.success_count
+        content.success_count = old + 1
+        PracticeLog.objects.create(content=content, user_id=user_id, day=day or date.today())
+        apply_progress(user_id, [(content, old, content.success_count)])
+    return content
+
+def log_practice(user_id, changes, day=None):
+    # 절대값 수정으로 늘어난 실천 횟수를 실천목표마다 한 행(count)으로 기록한다 (줄어든 경우 예전 기록은 그대로 둔다)
+    day = day or date.today()
+    PracticeLog.objects.bulk_create([
+        PracticeLog(content=content, user_id=user_id, day=day, count=new - old)
+        for content, old, new in changes if new > old
+    ])
+
+def practice_streak(user_id, today=None):
+    # 오늘(오늘 실천 전이면 어제)까지 연속으로 실천한 일수. (user, day) 인덱스 범위 조회
+    today = today or date.today()
+    days = PracticeLog.objects.filter(
+        user_id=user_id, day__lte=today, day__gt=today - timedelta(days=STREAK_LIMIT)
+    ).values_list('day', flat=True).distinct().order_by('-day')
+
+    streak = 0
+    expected = today
+    for day in days:
+        if day == expected - timedelta(days=1) and streak == 0:
+            expected = day
+        if day != expected:
+            break
+        streak += 1
+        expected = day - timedelta(days=1)
+    return streak
+
+def remove_main_progress(manda_main):
+    # 핵심목표 삭제 시 프로필 누적값에서 해당 목표의 실천 횟수를 뺀다
+    if manda_main.success_total:
+        UserProfile.objects.filter(user_id=manda_main.user_id).update(
+            success_count=F('success_count') - manda_main.success_total
+        )
+        invalidate_profile_on_commit(manda_main.user_id)
+
+def user_success_total(user_id):
+    # 프로필을 새로 만들 때의 누적 실천 횟수 (핵심목표별 누적값의 합)
+    return MandaMain.objects.filter(user_id=user_id).aggregate(
+        total=Coalesce(Sum('success_total'), 0, output_field=BigIntegerField())
+    )['total']
+
+def rebuild_progress(user_id):
+    # 누적값을 실천목표에서 다시 계산 (기존 데이터 반영 / 점검용)
+    contents = MandaContent.objects.filter(sub_id__main_id__user_id=user_id)
+    done = Q(success_count__gte=CONTENT_GOAL)
+
+    for model, field, goal in ((MandaSub, 'sub_id', CONTENTS_PER_SUB), (MandaMain, 'sub_id__main_id', CONTENTS_PER_MAIN)):
+        rows = contents.values(field).annotate(
+            total=Coalesce(Sum('success_count'), 0, output_field=BigIntegerField()), done_count=Count('id', filter=done),
+        )
+        objects = []
+        for row in rows:
+            objects.append(model(
+                pk=row[field], success_total=row['total'], done_contents=row['done_count'],
+                success=row['done_count'] >= goal,
+            ))
+        model.objects.bulk_update(objects, ['success_total', 'done_contents', 'success'])
+
+    total = contents.aggregate(total=Coalesce(Sum('success_count'), 0, output_field=BigIntegerField()))['total']
+    UserProfile.objects.filter(user_id=user_id).update(success_count=total)
+    invalidate_profile_on_commit(user_id)
@@ -0,0 +1,40 @@
+import random
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from .models import Reaction, FeedEmojiCounter
+
+# 피드/이모지 별 카운터 행 개수
+COUNTER_SHARDS = getattr(settings, 'REACTION_COUNTER_SHARDS', 8)
+
+def increment_emoji_count(feed_id, emoji_name, delta):
+    # 임의의 shard 하나만 갱신하므로 동시에 들어온 반응끼리 같은 행을 잠그지 않는다
+    shard = random.randrange(COUNTER_SHARDS)
+    counter = FeedEmojiCounter.objects.filter(feed_id=feed_id, emoji_name=emoji_name, shard=shard)
+    if counter.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            FeedEmojiCounter.objects.create(feed_id=feed_id, emoji_name=emoji_name, shard=shard, count=delta)
+    except IntegrityError:
+        counter.update(count=F('count') + delta)
+
+def add_reaction(user, feed_id, emoji_name):
+    with transaction.atomic():
+        _, created = Reaction.objects.get_or_create(user=user, feed_id=feed_id, emoji_name=emoji_name)
+        if created:
+            increment_emoji_count(feed_id, emoji_name, 1)
+    return created
+
+def remove_reaction(user, feed_id, emoji_name):
+    with transaction.atomic():
+        _, deleted = Reaction.objects.filter(user=user, feed_id=feed_id, emoji_name=emoji_name).delete()
+        removed = deleted.get(Reaction._meta.label, 0) > 0
+        if removed:
+            increment_emoji_count(feed_id, emoji_name, -1)
+    return removed
+
+def get_emoji_counts(feed_id):
+    # 이모지 수 x shard 수 만큼의 행만 합산
+    counts = FeedEmojiCounter.objects.filter(feed_id=feed_id).values('emoji_name').annotate(total=Sum('count'))
+    return {row['emoji_name']: row['total'] for row in counts if row['total'] > 0}
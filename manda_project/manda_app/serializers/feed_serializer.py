@@ -1,7 +1,21 @@
 from rest_framework import serializers
 from ..models import Feed
+from ..image_processing import pick_variant
+from ..image_uploader import image_url
 
 class FeedSerializer(serializers.ModelSerializer):
+    # context 의 image_width 에 맞는 가장 작은 변형 이미지 주소
+    feed_image_url = serializers.SerializerMethodField()
+
     class Meta:
         model = Feed
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+        read_only_fields = ('feed_image_variants',)
+        # 이미지는 업로드 파일 또는 upload/finalize 로 나중에 추가할 수 있다
+        extra_kwargs = {'feed_image': {'required': False}}
+
+    def get_feed_image_url(self, obj):
+        return image_url(pick_variant(obj.feed_image_variants, self.context.get('image_width')))
+
+class ReactionSerializer(serializers.Serializer):
+    emoji_name = serializers.CharField(max_length=50)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from ..models import MandaMain, MandaSub, MandaContent
+from ..progress import MAX_SUCCESS_COUNT
 
 class MandaMainSerializer(serializers.ModelSerializer):
     class Meta:
@@ -24,7 +25,7 @@ class MandaSubSerializer(serializers.ModelSerializer):
         fields = ('id', 'main_id', 'success', 'sub_title', 'content')
 
 class MandaMainViewSerializer(serializers.ModelSerializer):
-    sub_instances = MandaSubSerializer(many=True, read_only=True)
+    sub_instances = MandaSubSerializer(source='mandasub_set', many=True, read_only=True)
 
     class Meta:
         model = MandaMain
@@ -42,7 +43,7 @@ class MandaSubUpdateSerializer(serializers.Serializer):
 class MandaContentUpdateSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     content = serializers.CharField()
-    success_count = serializers.IntegerField()
+    success_count = serializers.IntegerField(min_value=0, max_value=MAX_SUCCESS_COUNT)
 
     def validate_content(self, value):
         if len(value) > 50:
@@ -0,0 +1,11 @@
+from rest_framework import serializers
+
+IMAGE_CONTENT_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+
+class PresignUploadSerializer(serializers.Serializer):
+    purpose = serializers.ChoiceField(choices=('profile', 'feed'))
+    content_type = serializers.ChoiceField(choices=IMAGE_CONTENT_TYPES)
+
+class FinalizeUploadSerializer(serializers.Serializer):
+    upload_token = serializers.CharField()
+    feed_id = serializers.IntegerField(required=False)
@@ -26,11 +26,12 @@ def validate_max_length2(value):
     return value
 
 class UserProfileSerializer(serializers.ModelSerializer):
-    user_img = serializers.ImageField(max_length=None, use_url=True, write_only=True)
+    user_img = serializers.ImageField(max_length=None, use_url=True, write_only=True, required=False)
     user_position = serializers.CharField(validators=[validate_max_length])
     user_info = serializers.CharField(validators=[validate_max_length2])
     user_hash = serializers.CharField(validators=[validate_max_length])
-    success_count = serializers.IntegerField()
+    # 실천 기록에서 집계하는 값이라 클라이언트가 바꿀 수 없다
+    success_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = UserProfile
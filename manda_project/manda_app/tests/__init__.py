@@ -1,3 +1,4 @@
 from .test_user import *
 from .test_manda import *
-from .test_chat import *
\ No newline at end of file
+from .test_chat import *
+from .test_feed import *
\ No newline at end of file
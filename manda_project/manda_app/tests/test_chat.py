@@ -6,6 +6,14 @@ from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 from ..models import ChatRoom, ChatMessage, UserProfile
 from ..manda_views import views_chat
+from ..consumers.message_queue import save_chat_messages
+from ..consumers.ephemeral import SignalThrottle, RoomSignalAggregator, presence_key
+from channels.layers import InMemoryChannelLayer
+from types import SimpleNamespace
+from ..consumers.chat_consumers import UserChatConsumer
+from django.core.cache import cache
+from asgiref.sync import async_to_sync
+import uuid
 
 class GetRoomsTestCase(TestCase):
     def setUp(self):
@@ -29,8 +37,11 @@ class GetRoomsTestCase(TestCase):
         self.assertIsNotNone(rooms_data)
         self.assertEqual(len(rooms_data), 2)
 
+        # 최근 메시지가 있는 방이 먼저 온다
+        self.assertEqual([room['chat_room_id'] for room in rooms_data], [chat_room2.pk, chat_room1.pk])
+
         # 로그인 한 유저가 starter 인 경우
-        first_room_data = rooms_data[0]
+        first_room_data = rooms_data[1]
         self.assertEqual(first_room_data['chat_room_id'], chat_room1.pk)
         self.assertEqual(first_room_data['starter_id'], self.user.pk)
         self.assertEqual(first_room_data['starter'], self.user.username)
@@ -38,19 +49,121 @@ class GetRoomsTestCase(TestCase):
         self.assertEqual(first_room_data['unread_message_count'], 0) 
 
         # 로그인 한 유저에게 채팅이 온 경우
-        second_room_data = rooms_data[1]
+        second_room_data = rooms_data[0]
         self.assertEqual(second_room_data['chat_room_id'], chat_room2.pk)
         self.assertEqual(second_room_data['starter_id'], self.user.pk)
         self.assertEqual(second_room_data['starter'], self.user.username)
         self.assertEqual(second_room_data['message'], 'Hi')
         self.assertEqual(second_room_data['unread_message_count'], 1)
 
+    def test_get_rooms_query_count(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        for i in range(3):
+            chat_room = ChatRoom.objects.create(starter=self.user2, receiver=self.user)
+            ChatMessage.objects.create(chatroom=chat_room, content=f'Hi {i}', author=self.user2)
+
+        # 채팅방 수와 관계없이 쿼리 한 번
+        with self.assertNumQueries(1):
+            response = client.get(self.url)
+        self.assertEqual(len(response.data['rooms']), 3)
+        self.assertEqual(response.data['rooms'][0]['message'], 'Hi 2')
+
+class ChatRoomMetadataTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.chat_room = ChatRoom.objects.create(starter=self.user, receiver=self.user2)
+
+    def test_message_updates_room_metadata(self):
+        # 순번 발급(채팅방 잠금) + 메시지 INSERT + 채팅방 UPDATE (+ TestCase 안에서는 SAVEPOINT / RELEASE)
+        with self.assertNumQueries(5):
+            chat_message = ChatMessage.objects.create(chatroom=self.chat_room, content='Hello', author=self.user)
+        ChatMessage.objects.create(chatroom=self.chat_room, content='Hi', author=self.user2)
+        ChatMessage.objects.create(chatroom=self.chat_room, content='Again', author=self.user)
+
+        self.chat_room.refresh_from_db()
+        self.assertEqual(self.chat_room.latest_message, 'Again')
+        self.assertGreaterEqual(self.chat_room.latest_message_time, chat_message.created_at)
+        self.assertEqual(self.chat_room.starter_unread_count, 1)
+        self.assertEqual(self.chat_room.receiver_unread_count, 2)
+        self.assertEqual(self.chat_room.last_seq, 3)
+        self.assertEqual(list(ChatMessage.objects.filter(chatroom=self.chat_room).values_list('seq', flat=True)), [1, 2, 3])
+
+    def test_mark_read_moves_watermark_forward(self):
+        first = ChatMessage.objects.create(chatroom=self.chat_room, content='1', author=self.user2)
+        second = ChatMessage.objects.create(chatroom=self.chat_room, content='2', author=self.user2)
+        ChatMessage.objects.create(chatroom=self.chat_room, content='3', author=self.user2)
+
+        self.assertEqual(self.chat_room.mark_read(self.user.id, second.pk), 1)
+        # 이미 지난 위치로는 되돌아가지 않는다
+        self.assertEqual(self.chat_room.mark_read(self.user.id, first.pk), 0)
+
+        self.chat_room.refresh_from_db()
+        self.assertEqual(self.chat_room.starter_last_read_id, second.pk)
+        self.assertEqual(self.chat_room.starter_unread_count, 1)
+
+class ChatMessageQueueTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.user2 = User.objects.create_user(username='testuser2', password='testpassword')
+        self.chat_room = ChatRoom.objects.create(starter=self.user, receiver=self.user2)
+
+    def test_persist_chat_messages_is_idempotent(self):
+        chat_uuid = uuid.uuid4()
+        batch = [
+            ChatMessage(chatroom=self.chat_room, author=self.user, content='Hello', chat_uuid=chat_uuid),
+            ChatMessage(chatroom=self.chat_room, author=self.user, content='Hello', chat_uuid=chat_uuid),
+            ChatMessage(chatroom=self.chat_room, author=self.user2, content='Hi', chat_uuid=uuid.uuid4()),
+        ]
+        # async 래퍼는 연결을 정리(close_old_connections)하므로 TestCase 에서는 sync 함수를 직접 호출
+        save_chat_messages(batch)
+        save_chat_messages([
+            ChatMessage(chatroom=self.chat_room, author=self.user, content='Hello', chat_uuid=chat_uuid),
+        ])
+
+        # 같은 chat_uuid 는 한 번만 저장되고 채팅방 정보도 한 번만 반영
+        self.assertEqual(list(ChatMessage.objects.filter(chatroom=self.chat_room).values_list('seq', flat=True)), [1, 2])
+        self.chat_room.refresh_from_db()
+        self.assertEqual(self.chat_room.latest_message, 'Hi')
+        self.assertEqual(self.chat_room.starter_unread_count, 1)
+        self.assertEqual(self.chat_room.receiver_unread_count, 1)
+
+    def test_persist_skips_messages_saved_by_another_batch(self):
+        chat_uuid = uuid.uuid4()
+        ChatMessage.objects.create(chatroom=self.chat_room, author=self.user, content='Hello', chat_uuid=chat_uuid)
+
+        # 다른 배치가 먼저 저장한 메시지는 반환(= publish)되지 않고 순번 / 안 읽은 수도 한 번만 반영
+        saved = save_chat_messages([
+            ChatMessage(chatroom=self.chat_room, author=self.user, content='Hello', chat_uuid=chat_uuid),
+            ChatMessage(chatroom=self.chat_room, author=self.user, content='Again', chat_uuid=uuid.uuid4()),
+        ])
+        self.assertEqual([chat_msg.content for chat_msg in saved], ['Again'])
+        self.assertEqual(saved[0].seq, 2)
+        self.chat_room.refresh_from_db()
+        self.assertEqual(self.chat_room.last_seq, 2)
+        self.assertEqual(self.chat_room.receiver_unread_count, 2)
+
+    def test_backfill_seq_numbers_old_messages(self):
+        old = ChatMessage.objects.create(chatroom=self.chat_room, author=self.user, content='old')
+        new = ChatMessage.objects.create(chatroom=self.chat_room, author=self.user2, content='new')
+        # 순번 도입 전 메시지
+        ChatMessage.objects.filter(pk=old.pk).update(seq=None)
+
+        self.assertEqual(self.chat_room.backfill_seq(), 2)
+        self.assertEqual(list(ChatMessage.objects.filter(chatroom=self.chat_room).order_by('id').values_list('seq', flat=True)), [1, 2])
+        self.chat_room.refresh_from_db()
+        self.assertEqual(self.chat_room.last_seq, 2)
+        # 이미 모두 순번이 있으면 아무것도 바꾸지 않는다
+        self.assertEqual(self.chat_room.backfill_seq(), 0)
+        self.assertEqual(ChatMessage.objects.get(pk=new.pk).seq, 2)
+
 class ChatHistoryTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpassword')
         self.sender = User.objects.create_user(username='sender', password='senderpassword')
         self.client = APIClient()
-        self.client.login(username='testuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
         self.chat_room = ChatRoom.objects.create(starter=self.user)
         self.chat_message1 = ChatMessage.objects.create(chatroom=self.chat_room, content='Hello', author=self.user, is_read=False)
         self.chat_message2 = ChatMessage.objects.create(chatroom=self.chat_room, content='Hi', author=self.sender, is_read=False)
@@ -68,6 +181,7 @@ class ChatHistoryTestCase(TestCase):
                     'username': self.user.username,
                     'is_read': False,
                     'id': self.chat_message1.pk,
+                    'seq': 1,
                 },
                 {
                     'created_at': views_chat.format_datetime(self.chat_message1.created_at),
@@ -75,11 +189,102 @@ class ChatHistoryTestCase(TestCase):
                     'username': self.sender.username,
                     'is_read': True,
                     'id': self.chat_message2.pk,
+                    'seq': 2,
                 }
             ],
-            'first_unread_index': 2,
-            'sender': self.sender.username
+            'first_unread_index': self.chat_message2.pk,
+            'sender': self.sender.username,
+            'next_cursor': None
         }
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data, expected_data)
+
+    def test_chat_history_since(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        chat_message3 = ChatMessage.objects.create(chatroom=self.chat_room, content='New', author=self.sender)
+
+        self.chat_room.mark_read(self.user.id, self.chat_message2.pk)
+
+        response = client.get(self.url, {'since': self.chat_message2.pk})
+
+        # since 이후의 메시지만 받고, 받은 메시지까지 읽음 처리
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([msg['id'] for msg in response.data['chat_msgs']], [chat_message3.pk])
+        self.assertEqual(response.data['first_unread_index'], chat_message3.pk)
+        self.chat_room.refresh_from_db()
+        self.assertEqual(self.chat_room.starter_last_read_id, chat_message3.pk)
+        self.assertEqual(self.chat_room.starter_unread_count, 0)
+
+    def test_partial_page_does_not_mark_skipped_messages_read(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        chat_message3 = ChatMessage.objects.create(chatroom=self.chat_room, content='New', author=self.sender)
+
+        # 가장 최근 한 개만 받으면 그 앞의 안 읽은 메시지(chat_message2)는 받지 않았으므로 읽음 처리하지 않는다
+        response = client.get(self.url, {'size': 1})
+        self.assertEqual([msg['id'] for msg in response.data['chat_msgs']], [chat_message3.pk])
+        self.assertEqual(response.data['first_unread_index'], self.chat_message2.pk)
+        self.chat_room.refresh_from_db()
+        self.assertEqual(self.chat_room.starter_last_read_id, 0)
+
+        response = client.get(self.url, {'since': self.chat_message1.pk})
+        self.chat_room.refresh_from_db()
+        self.assertEqual(self.chat_room.starter_last_read_id, chat_message3.pk)
+        self.assertEqual(self.chat_room.starter_unread_count, 0)
+
+    def test_chat_history_requires_membership(self):
+        outsider = User.objects.create_user(username='outsider', password='outsiderpassword')
+        client = APIClient()
+        client.force_authenticate(user=outsider)
+
+        # 참여하지 않은 채팅방은 조회할 수 없고 읽음 처리도 바뀌지 않는다
+        response = client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+        self.chat_room.refresh_from_db()
+        self.assertEqual(self.chat_room.starter_last_read_id, 0)
+
+        response = APIClient().get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+class SignalThrottleTestCase(TestCase):
+    def test_throttle_per_room_and_kind(self):
+        throttle = SignalThrottle(interval=2.0)
+
+        self.assertTrue(throttle.allow(1, 'typing', now=0.0))
+        self.assertFalse(throttle.allow(1, 'typing', now=1.0))
+        # 다른 채팅방 / 다른 신호는 따로 계산
+        self.assertTrue(throttle.allow(2, 'typing', now=1.0))
+        self.assertTrue(throttle.allow(1, 'ping', now=1.0))
+        self.assertTrue(throttle.allow(1, 'typing', now=2.5))
+
+class PresenceTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        cache.delete(presence_key(self.user.id))
+
+    def test_presence_counts_open_sockets(self):
+        first, second = UserChatConsumer(), UserChatConsumer()
+        first.user = second.user = self.user
+
+        self.assertEqual(async_to_sync(first.count_connection)(1), 1)
+        self.assertEqual(async_to_sync(second.count_connection)(1), 2)
+        # 소켓 하나가 닫혀도 다른 소켓이 열려 있으면 online 유지
+        self.assertEqual(async_to_sync(first.count_connection)(-1), 1)
+        self.assertIsNotNone(cache.get(presence_key(self.user.id)))
+        self.assertEqual(async_to_sync(second.count_connection)(-1), 0)
+        self.assertIsNone(cache.get(presence_key(self.user.id)))
+
+    def test_quick_reconnect_delivers_latest_state(self):
+        aggregator = RoomSignalAggregator(window=3600, channel_layer=InMemoryChannelLayer())
+        room = SimpleNamespace(pk=1, starter_id=1, receiver_id=2)
+
+        async def reconnect():
+            for state in ('online', 'offline', 'online'):
+                aggregator.add(room, 'testuser', state)
+            aggregator.task.cancel()
+            return dict(aggregator.pending)
+
+        # 짧은 재접속은 버려지지 않고 마지막 상태(online)로 모여서 전달된다
+        self.assertEqual(async_to_sync(reconnect)(), {1: {'testuser': 'online'}})
@@ -0,0 +1,153 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from unittest import mock
+from datetime import date
+from ..models import MandaMain, MandaContent, Feed, Follow, TimelineEntry, PullAuthor, Reaction, DailyActivity
+from .. import timeline
+from ..activity import record_feed_activity
+
+def create_feed(user, manda_main, text='feed'):
+    content = MandaContent.objects.filter(sub_id__main_id=manda_main).first()
+    return Feed.objects.create(
+        user=user,
+        main_id=manda_main,
+        sub_id=content.sub_id,
+        cont_id=content,
+        feed_contents=text,
+        feed_image='feed_images/test.jpg',
+        feed_hash='#test',
+    )
+
+class TimelineTestCase(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='testpassword')
+        self.reader = User.objects.create_user(username='reader', password='testpassword')
+        Follow.objects.create(follower_user=self.reader, following_user=self.author)
+        self.manda_main = MandaMain.objects.create(user=self.author, main_title='Main Title')
+        self.client = APIClient()
+
+    def test_fan_out_on_write(self):
+        feed = create_feed(self.author, self.manda_main)
+        timeline.fan_out_feed(feed)
+
+        # 작성자와 팔로워 타임라인에 모두 들어가야 함
+        self.assertTrue(TimelineEntry.objects.filter(user=self.author, feed=feed).exists())
+        self.assertTrue(TimelineEntry.objects.filter(user=self.reader, feed=feed).exists())
+
+    def test_pull_author_is_not_fanned_out(self):
+        feed = create_feed(self.author, self.manda_main)
+        with mock.patch.object(timeline, 'FANOUT_LIMIT', 0):
+            timeline.fan_out_feed(feed)
+
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+        self.assertTrue(PullAuthor.objects.filter(user=self.author).exists())
+
+        feeds, next_cursor = timeline.read_timeline(self.reader.id)
+        self.assertEqual(feeds, [feed])
+        self.assertIsNone(next_cursor)
+
+    def test_leaving_pull_mode_backfills_timeline(self):
+        pulled = create_feed(self.author, self.manda_main, 'pulled')
+        with mock.patch.object(timeline, 'FANOUT_LIMIT', 0), mock.patch.object(timeline, 'FANOUT_EXIT_LIMIT', 0):
+            timeline.fan_out_feed(pulled)
+        self.assertTrue(PullAuthor.objects.filter(user=self.author).exists())
+
+        # 팔로워 수가 다시 줄면 읽기 시점 조회 동안 쓴 피드도 타임라인에 남아 있어야 함
+        feed = create_feed(self.author, self.manda_main, 'fanned out')
+        with mock.patch.object(timeline, 'FANOUT_EXIT_LIMIT', 10):
+            timeline.fan_out_feed(feed)
+        self.assertFalse(PullAuthor.objects.filter(user=self.author).exists())
+        feeds, _ = timeline.read_timeline(self.reader.id)
+        self.assertEqual(feeds, [feed, pulled])
+
+    def test_timeline_pagination(self):
+        feeds = [create_feed(self.author, self.manda_main, f'feed {i}') for i in range(3)]
+        for feed in feeds:
+            timeline.fan_out_feed(feed)
+
+        response = self.client.get(reverse('user_timeline', args=[self.reader.id]), {'size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([f['id'] for f in response.data['feeds']], [feeds[2].id, feeds[1].id])
+
+        response = self.client.get(reverse('user_timeline', args=[self.reader.id]), {'size': 2, 'cursor': response.data['next_cursor']})
+        self.assertEqual([f['id'] for f in response.data['feeds']], [feeds[0].id])
+        self.assertIsNone(response.data['next_cursor'])
+
+class ReactionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        self.manda_main = MandaMain.objects.create(user=self.user, main_title='Main Title')
+        self.feed = create_feed(self.user, self.manda_main)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('react_feed', args=[self.feed.id])
+
+    def test_react_feed(self):
+        self.client.post(self.url, {'emoji_name': 'like'}, format='json')
+        response = self.client.post(self.url, {'emoji_name': 'like'}, format='json')
+
+        # 같은 유저의 같은 이모지는 한 번만 집계
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['emoji_count'], {'like': 1})
+
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.post(self.url, {'emoji_name': 'like'}, format='json')
+        self.assertEqual(response.data['emoji_count'], {'like': 2})
+
+    def test_remove_reaction(self):
+        self.client.post(self.url, {'emoji_name': 'like'}, format='json')
+        response = self.client.delete(self.url, {'emoji_name': 'like'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['emoji_count'], {})
+        self.assertFalse(Reaction.objects.filter(feed=self.feed).exists())
+
+class ActivityHeatmapTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='author', password='testpassword')
+        self.manda_main = MandaMain.objects.create(user=self.user, main_title='Main Title')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_heatmap_buckets(self):
+        for day, count in ((date(2023, 1, 2), 2), (date(2023, 1, 4), 1), (date(2023, 2, 1), 3), (date(2021, 1, 1), 5)):
+            for _ in range(count):
+                record_feed_activity(self.user.id, day, 1)
+        url = reverse('user_feed_log', args=[self.user.id])
+
+        response = self.client.get(url, {'end': '2023-12-31'})
+        self.assertEqual(response.data['logs'], [
+            {'date': date(2023, 1, 2), 'feed_count': 2},
+            {'date': date(2023, 1, 4), 'feed_count': 1},
+            {'date': date(2023, 2, 1), 'feed_count': 3},
+        ])
+        response = self.client.get(url, {'end': '2023-12-31', 'bucket': 'week'})
+        self.assertEqual([row['feed_count'] for row in response.data['logs']], [3, 3])
+        response = self.client.get(url, {'end': '2023-12-31', 'bucket': 'month'})
+        self.assertEqual(response.data['logs'], [
+            {'date': date(2023, 1, 1), 'feed_count': 3},
+            {'date': date(2023, 2, 1), 'feed_count': 3},
+        ])
+        self.assertEqual(self.client.get(url, {'bucket': 'year'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_feed_decrements_activity(self):
+        feed = create_feed(self.user, self.manda_main)
+        record_feed_activity(self.user.id, feed.created_at.date(), 1)
+
+        response = self.client.delete(reverse('delete_feed', args=[feed.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(DailyActivity.objects.get(user=self.user).feed_count, 0)
+
+    def test_delete_main_decrements_cascaded_feeds(self):
+        for _ in range(2):
+            feed = create_feed(self.user, self.manda_main)
+            record_feed_activity(self.user.id, feed.created_at.date(), 1)
+
+        # 만다라트와 함께 지워지는 피드도 히트맵에서 빠진다
+        response = self.client.delete(reverse('delete_manda', args=[self.manda_main.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(DailyActivity.objects.get(user=self.user).feed_count, 0)
@@ -1,11 +1,15 @@
 from collections import OrderedDict
+from datetime import date, timedelta
 from django.test import TestCase
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 from rest_framework import status
-from ..models import MandaMain, MandaSub, MandaContent
+from ..models import MandaMain, MandaSub, MandaContent, UserProfile, PracticeLog
 from ..serializers.manda_serializer import *
+from ..pagination import encode_cursor
+from ..progress import MAX_SUCCESS_COUNT
 from django.urls import reverse
 import json
 
@@ -217,22 +221,53 @@ class MandaMainViewTest(TestCase):
         self.assertEqual(len(response.data['subs']), 8)
         self.assertEqual(len(response.data['contents']), 64)
 
+    def test_manda_main_view_compact(self):
+        response = self.client.get(self.url, {'compact': 'true'})
+
+        subs = list(MandaSub.objects.filter(main_id=self.manda_main))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['subs']['id'], [sub.id for sub in subs])
+        self.assertEqual(len(response.data['contents']['id']), 8)
+        for row, sub in zip(response.data['contents']['id'], subs):
+            expected_ids = list(MandaContent.objects.filter(sub_id=sub).values_list('id', flat=True))
+            self.assertEqual(row, expected_ids)
+
+    def test_manda_main_view_query_count(self):
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
 class MandaMainListViewTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpassword')
         self.client.login(username='testuser', password='testpassword')
         MandaMain.objects.create(user=self.user, success=False, main_title='Test Main Title 1')
         MandaMain.objects.create(user=self.user, success=True, main_title='Test Main Title 2')
-        self.url = reverse('usermanda')
+        self.url = reverse('usermanda', args=[self.user.id])
 
     def test_manda_main_list_view(self):
         response = self.client.get(self.url)
 
         expected_data = MandaMainSerializer(MandaMain.objects.all(), many=True).data
 
-        self.assertEqual(response.data, expected_data)
+        self.assertEqual(response.data['mandas'], expected_data)
+        self.assertIsNone(response.data['next_cursor'])
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_manda_main_list_pagination(self):
+        first_page = self.client.get(self.url, {'size': 1})
+        second_page = self.client.get(self.url, {'size': 1, 'cursor': first_page.data['next_cursor']})
+
+        self.assertEqual(first_page.data['mandas'][0]['main_title'], 'Test Main Title 1')
+        self.assertEqual(second_page.data['mandas'][0]['main_title'], 'Test Main Title 2')
+        self.assertIsNone(second_page.data['next_cursor'])
+
+    def test_manda_main_list_invalid_cursor(self):
+        # 조작된 cursor 는 무시하고 첫 페이지를 반환
+        for cursor in (encode_cursor([[1]]), encode_cursor([{}]), 'not-a-cursor'):
+            response = self.client.get(self.url, {'size': 1, 'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['mandas'][0]['main_title'], 'Test Main Title 1')
+
 class OthersMandaMainListTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpassword')
@@ -249,10 +284,11 @@ class OthersMandaMainListTestCase(APITestCase):
 
         user_id = self.other_user.id
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn(user_id, response.data)
-        self.assertIsInstance(response.data[user_id], list)
-        self.assertEqual(len(response.data[user_id]), 2) 
-        manda_main_entry = response.data[user_id][0]
+        self.assertIsInstance(response.data['mandas'], list)
+        self.assertEqual(len(response.data['mandas']), 2) 
+        self.assertIsNone(response.data['next_cursor'])
+        manda_main_entry = response.data['mandas'][0]
+        self.assertEqual(manda_main_entry['user_id'], user_id)
         self.assertIn('id', manda_main_entry)
         self.assertIn('success', manda_main_entry)
         self.assertIn('main_title', manda_main_entry)
@@ -264,6 +300,18 @@ class OthersMandaMainListTestCase(APITestCase):
         self.assertIn('success', manda_sub_entry)
         self.assertIn('sub_title', manda_sub_entry)
 
+    def test_others_manda_main_list_pagination(self):
+        # 토큰 인증만 받는 API 이므로 세션 로그인 대신 force_authenticate
+        self.client.force_authenticate(user=self.user)
+        first_page = self.client.get(self.url, {'size': 1})
+        self.assertEqual(len(first_page.data['mandas']), 1)
+        self.assertIsNotNone(first_page.data['next_cursor'])
+
+        second_page = self.client.get(self.url, {'size': 1, 'cursor': first_page.data['next_cursor']})
+        self.assertEqual(len(second_page.data['mandas']), 1)
+        self.assertLess(second_page.data['mandas'][0]['id'], first_page.data['mandas'][0]['id'])
+        self.assertIsNone(second_page.data['next_cursor'])
+
 class UpdateMandaContentsTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpassword')
@@ -324,6 +372,22 @@ class UpdateMandaContentsTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertIn('MandaContent with ID 999 does not exist for the current user.', response.data)
 
+    def test_partial_failure_rolls_back(self):
+        data = {
+            'contents': [
+                {'id': self.manda_contents[0].id, 'content': 'Should Not Apply', "success_count": 0},
+                {'id': 999999, 'content': 'Valid Value', "success_count": 0},
+            ]
+        }
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post(self.url, data=json.dumps(data), content_type='application/json')
+
+        # 일부 id 가 잘못되면 나머지도 반영되지 않아야 함
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(MandaContent.objects.get(id=self.manda_contents[0].id).content)
+
 class UpdateMandaMainTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpassword')
@@ -347,6 +411,23 @@ class UpdateMandaMainTestCase(TestCase):
         manda_main.refresh_from_db()
         self.assertEqual(manda_main.main_title, 'Updated Title')
 
+    def test_update_manda_main_keeps_grid(self):
+        # API 는 토큰 인증만 받으므로 세션 로그인 대신 force_authenticate
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        data = {
+            'user': self.user.id,
+            'id': self.manda_main.id,
+            'main_title': 'Renamed Title',
+        }
+
+        response = client.patch(self.url, json.dumps(data), content_type='application/json')
+
+        # 제목 변경 시 세부목표/실천목표가 추가로 생성되지 않아야 함
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(MandaSub.objects.filter(main_id=self.manda_main).count(), 8)
+        self.assertEqual(MandaContent.objects.filter(sub_id__main_id=self.manda_main).count(), 64)
+
     def test_update_manda_main_invalid_id(self):
         data = {
             'user': self.user.id,
@@ -394,3 +475,119 @@ class UpdateMandaMainTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.manda_main.refresh_from_db()
         self.assertIn('main_title', response.data)
+
+class ProgressRollupTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.profile = UserProfile.objects.create(user=self.user, user_image='')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.manda_main = MandaMain.objects.create(user=self.user, main_title='Main Title')
+        self.subs = list(MandaSub.objects.filter(main_id=self.manda_main))
+        self.contents = list(MandaContent.objects.filter(sub_id=self.subs[0]))
+
+    def update_contents(self, counts):
+        data = {'contents': [
+            {'id': content.id, 'content': 'content', 'success_count': count}
+            for content, count in zip(self.contents, counts)
+        ]}
+        response = self.client.post(reverse('edit_content'), json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_content_updates_roll_up(self):
+        self.update_contents([3, 1, 0])
+        self.update_contents([1, 1, 2])
+
+        sub = MandaSub.objects.get(pk=self.subs[0].pk)
+        self.assertEqual((sub.success_total, sub.done_contents, sub.success), (4, 3, False))
+        self.manda_main.refresh_from_db()
+        self.assertEqual((self.manda_main.success_total, self.manda_main.done_contents), (4, 3))
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.success_count, 4)
+
+        # 세부목표의 실천목표 8개를 모두 완료하면 세부목표 성공
+        self.update_contents([1] * 8)
+        sub.refresh_from_db()
+        self.assertEqual((sub.done_contents, sub.success), (8, True))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('manda_progress', args=[self.manda_main.id]))
+        self.assertEqual(response.data['success_total'], 8)
+        self.assertEqual(response.data['subs'][0]['success'], True)
+
+    def test_content_updates_log_practice(self):
+        self.update_contents([2, 1])
+        # 줄어든 실천 횟수는 예전 기록을 지우지 않는다
+        self.update_contents([1, 1])
+        logs = PracticeLog.objects.filter(user=self.user, day=date.today())
+        self.assertEqual(logs.count(), 2)
+        self.assertEqual(sum(logs.values_list('count', flat=True)), 3)
+        self.assertEqual(logs.get(content=self.contents[0]).count, 2)
+
+    def test_content_update_rejects_out_of_range_counts(self):
+        for count in (-5, MAX_SUCCESS_COUNT + 1):
+            data = {'contents': [{'id': self.contents[0].id, 'content': 'content', 'success_count': count}]}
+            response = self.client.post(reverse('edit_content'), json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PracticeLog.objects.exists())
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.success_count, 0)
+
+    def test_profile_cache_invalidated_on_commit(self):
+        cache.clear()
+        url = reverse('view_profile', args=[self.user.id])
+        self.assertEqual(self.client.get(url).data['success_count'], 0)
+
+        # 무효화는 커밋 후에 실행되고, 그 다음 조회부터 새 값을 읽는다
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.update_contents([2])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.client.get(url).data['success_count'], 2)
+
+    def test_delete_main_removes_progress(self):
+        self.update_contents([2, 2])
+        self.client.delete(reverse('delete_manda', args=[self.manda_main.id]))
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.success_count, 0)
+
+    def test_profile_success_count_is_not_writable(self):
+        self.update_contents([2, 1])
+        self.profile.delete()
+
+        # 새 프로필은 클라이언트 값 대신 기존 실천 횟수로 시작하고 수정 요청으로도 바뀌지 않는다
+        data = {'user': self.user.id, 'user_position': 'p', 'user_info': 'i', 'user_hash': '#h', 'success_count': 100}
+        response = self.client.post(reverse('write_profile'), data, format='json')
+        self.assertEqual(response.data['success_count'], 3)
+        response = self.client.patch(reverse('edit_profile'), data, format='json')
+        self.assertEqual(UserProfile.objects.get(user=self.user).success_count, 3)
+
+class CheckInTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.profile = UserProfile.objects.create(user=self.user, user_image='')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.manda_main = MandaMain.objects.create(user=self.user, main_title='Main Title')
+        self.content = MandaContent.objects.filter(sub_id__main_id=self.manda_main).first()
+
+    def test_check_in_increments_and_logs(self):
+        PracticeLog.objects.create(content=self.content, user=self.user, day=date.today() - timedelta(days=1))
+        url = reverse('checkin_content', args=[self.content.id])
+        self.client.post(url)
+        response = self.client.post(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['success_count'], 2)
+        self.assertEqual(response.data['streak'], 2)
+        self.assertEqual(PracticeLog.objects.filter(content=self.content, day=date.today()).count(), 2)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.success_count, 2)
+
+    def test_check_in_other_users_content(self):
+        other = User.objects.create_user(username='other', password='testpassword')
+        other_main = MandaMain.objects.create(user=other, main_title='Other')
+        content = MandaContent.objects.filter(sub_id__main_id=other_main).first()
+
+        response = self.client.post(reverse('checkin_content', args=[content.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(PracticeLog.objects.exists())
@@ -4,6 +4,16 @@ from rest_framework import status
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock
+from PIL import Image
+from .. import image_uploader
+from ..models import StoredImage, UserProfile, UsedUploadToken
+from ..image_processing import process_image, pick_variant, InvalidImage
+from ..profile_cache import invalidate_profile
+from ..manda_views import views_users
+import io
 
 class LoginAPITest(TestCase):
     def setUp(self):
@@ -175,3 +185,217 @@ class DeleteUserAPITest(TestCase):
         # 탈퇴한 계정 로그인시 실패 확인
         response_login_after_delete = self.client.post(self.login_url, self.user_data, format='json')
         self.assertEqual(response_login_after_delete.status_code, status.HTTP_400_BAD_REQUEST)
+
+class ImageUploaderTest(TestCase):
+    def test_upload_to_storage(self):
+        storage = image_uploader.InMemoryStorage()
+        with mock.patch.object(image_uploader, 'storage', storage):
+            key = image_uploader.S3ImgUploader(
+                SimpleUploadedFile('a.png', b'png-bytes', content_type='image/png')
+            ).upload(parallel=False)
+
+        self.assertTrue(key.startswith('img/'))
+        self.assertEqual(storage.objects[key], (b'png-bytes', 'image/png'))
+
+    def test_failed_pool_upload_falls_back(self):
+        storage = image_uploader.InMemoryStorage()
+        save = storage.save
+        calls = []
+
+        def flaky_save(key, fileobj, content_type):
+            calls.append(key)
+            if len(calls) == 1:
+                raise OSError('upload failed')
+            save(key, fileobj, content_type)
+
+        # 업로드 풀에서 실패하면 요청 안에서 다시 시도하고, 저장된 뒤에만 key 를 돌려준다
+        with mock.patch.object(image_uploader, 'storage', storage), mock.patch.object(storage, 'save', flaky_save):
+            key = image_uploader.S3ImgUploader(
+                SimpleUploadedFile('a.png', b'png-bytes', content_type='image/png')
+            ).upload(parallel=True)
+
+        self.assertEqual(calls, [key, key])
+        self.assertEqual(storage.objects[key], (b'png-bytes', 'image/png'))
+
+class ImageProcessingTest(TestCase):
+    def make_image(self, size, fmt='PNG'):
+        output = io.BytesIO()
+        Image.new('RGB', size, 'red').save(output, fmt)
+        output.seek(0)
+        return output
+
+    def test_variants_are_resized_once(self):
+        variants = process_image(self.make_image((3000, 1500)))
+        sizes = {name: Image.open(fileobj).size for name, fileobj in variants.items()}
+        self.assertEqual(sizes, {'original': (2048, 1024), 'feed': (1080, 540), 'thumb': (320, 160)})
+
+    def test_invalid_image(self):
+        with self.assertRaises(InvalidImage):
+            process_image(io.BytesIO(b'not an image'))
+
+    def test_pick_variant(self):
+        variants = {'original': 'o', 'feed': 'f', 'thumb': 't'}
+        self.assertEqual(pick_variant(variants, 100), 't')
+        self.assertEqual(pick_variant(variants, 500), 'f')
+        self.assertEqual(pick_variant(variants, 5000), 'o')
+        self.assertEqual(pick_variant(variants), 'o')
+        self.assertIsNone(pick_variant({}))
+
+class ImageDedupTest(TestCase):
+    def test_same_image_is_stored_once_and_collected(self):
+        storage = image_uploader.InMemoryStorage()
+        digest = 'a' * 64
+        key = f'img/{digest}/original.webp'
+        builds = []
+
+        def build():
+            builds.append(key)
+            storage.objects[key] = (b'webp', 'image/webp')
+            return {'original': key}
+
+        with mock.patch.object(image_uploader, 'storage', storage):
+            self.assertEqual(image_uploader.prepare_image(digest, build), {'original': key})
+            self.assertEqual(image_uploader.prepare_image(digest, build), {'original': key})
+            self.assertEqual(len(builds), 1)
+            # 참조 수는 저장할 때 acquire_images 로 올린다
+            self.assertEqual(StoredImage.objects.get(digest=digest).ref_count, 0)
+            image_uploader.acquire_images(key, key)
+            self.assertEqual(StoredImage.objects.get(digest=digest).ref_count, 2)
+
+            image_uploader.release_images(key)
+            self.assertEqual(image_uploader.collect_garbage(grace=-1), 0)
+            image_uploader.release_images(key)
+            self.assertEqual(image_uploader.collect_garbage(grace=-1), 1)
+
+        self.assertFalse(StoredImage.objects.filter(digest=digest).exists())
+        self.assertEqual(storage.objects, {})
+
+    def test_deleting_user_releases_images(self):
+        user = User.objects.create_user(username='owner', password='testpassword')
+        digest = 'b' * 64
+        key = f'img/{digest}/original.webp'
+        StoredImage.objects.create(digest=digest, variants={'original': key}, ref_count=1)
+        UserProfile.objects.create(user=user, user_image=key)
+
+        client = APIClient()
+        client.login(username='owner', password='testpassword')
+        client.force_authenticate(user=user)
+        response = client.delete(reverse('delete_user'))
+
+        # 함께 지워진 프로필의 이미지는 참조가 내려가 GC 대상이 된다
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(StoredImage.objects.get(digest=digest).ref_count, 0)
+
+class DirectUploadTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='uploader', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.storage = image_uploader.InMemoryStorage()
+        for patcher in (
+            mock.patch.object(image_uploader, 'storage', self.storage),
+            mock.patch.object(image_uploader, 'IMAGE_UPLOAD_PARALLEL', False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def presign(self):
+        response = self.client.post(reverse('presign_upload'), {'purpose': 'profile', 'content_type': 'image/png'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_presign_upload_finalize(self):
+        image = io.BytesIO()
+        Image.new('RGB', (400, 200), 'blue').save(image, 'PNG')
+        target = self.presign()
+
+        # 로컬 업로드 서버로 바로 업로드 (인증 없이 policy 로만 확인)
+        upload = APIClient().post(target['url'], {
+            **target['fields'],
+            'file': SimpleUploadedFile('a.png', image.getvalue(), content_type='image/png'),
+        }, format='multipart')
+        self.assertEqual(upload.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.post(reverse('finalize_upload'), {'upload_token': target['upload_token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.user_image, response.data['variants']['original'])
+        self.assertIn(profile.user_image, self.storage.objects)
+        # 임시 업로드 객체는 삭제되고 같은 토큰으로 다시 반영할 수 없다
+        self.assertFalse(self.storage.exists(target['fields']['key']))
+        response = self.client.post(reverse('finalize_upload'), {'upload_token': target['upload_token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_finalize_token_is_single_use(self):
+        target = self.presign()
+        self.storage.objects[target['fields']['key']] = (b'not an image', 'image/png')
+
+        # 처리에 실패해도 토큰은 먼저 사용 처리되어 다시 쓸 수 없다
+        response = self.client.post(reverse('finalize_upload'), {'upload_token': target['upload_token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.storage.objects[target['fields']['key']] = (b'not an image', 'image/png')
+        response = self.client.post(reverse('finalize_upload'), {'upload_token': target['upload_token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Upload token has already been used.')
+        self.assertTrue(UsedUploadToken.objects.filter(key=target['fields']['key']).exists())
+
+    def test_local_upload_rejects_tampered_policy(self):
+        target = self.presign()
+        response = APIClient().post(target['url'], {
+            **target['fields'],
+            'key': 'uploads/other',
+            'file': SimpleUploadedFile('a.png', b'png', content_type='image/png'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class ProfileCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cached', password='testpassword')
+        self.profile = UserProfile.objects.create(user=self.user, user_image='', user_info='before')
+        self.client = APIClient()
+
+    def test_read_through_and_invalidate(self):
+        url = reverse('view_profile', args=[self.user.id])
+        self.assertEqual(self.client.get(url).data['user_info'], 'before')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data['username'], 'cached')
+
+        self.profile.user_info = 'after'
+        self.profile.save()
+        self.assertEqual(self.client.get(url).data['user_info'], 'before')
+        invalidate_profile(self.user.id)
+        self.assertEqual(self.client.get(url).data['user_info'], 'after')
+
+    def test_missing_profile(self):
+        other = User.objects.create_user(username='noprofile', password='testpassword')
+        response = self.client.get(reverse('view_profile', args=[other.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class ProfileBatchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpassword') for i in range(3)]
+        for user in self.users:
+            UserProfile.objects.create(user=user, user_image='')
+        self.client = APIClient()
+
+    def test_batch_merges_cache_hits_with_one_query(self):
+        ids = [user.id for user in self.users]
+        # 첫 번째 유저만 캐시에 올려둔다
+        self.client.get(reverse('view_profile', args=[ids[0]]))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('view_profiles'), {'ids': f'{ids[2]},{ids[0]},{ids[1]},999999'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([profile['user_id'] for profile in response.data['profiles']], [ids[2], ids[0], ids[1]])
+        self.assertEqual(response.data['missing'], [999999])
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse('view_profiles'), {'ids': ','.join(map(str, ids))})
+
+    def test_batch_limit(self):
+        with mock.patch.object(views_users, 'PROFILE_BATCH_LIMIT', 2):
+            response = self.client.get(reverse('view_profiles'), {'ids': '1,2,3'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.db import transaction
+from .models import Feed, Follow, TimelineEntry, PullAuthor
+
+# 팔로워 수가 이 값을 넘으면 팬아웃하지 않고 읽기 시점에 조회
+FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 1000)
+# 읽기 시점 조회로 바뀐 작성자는 팔로워 수가 이 값 이하로 줄어야 다시 팬아웃 (경계에서 오가지 않도록)
+FANOUT_EXIT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_EXIT_LIMIT', FANOUT_LIMIT * 3 // 4)
+FANOUT_BATCH_SIZE = 1000
+
+def fan_out_feed(feed):
+    author_id = feed.user_id
+    follower_ids = Follow.objects.filter(following_user=author_id).values_list('follower_user', flat=True)
+
+    with transaction.atomic():
+        # 작성자 본인 타임라인에는 항상 추가
+        entries = [TimelineEntry(user_id=author_id, feed=feed)]
+
+        follower_count = follower_ids.count()
+        pull_author = PullAuthor.objects.select_for_update().filter(user_id=author_id).first()
+        if pull_author is None:
+            pull = follower_count > FANOUT_LIMIT
+            if pull:
+                PullAuthor.objects.create(user_id=author_id, since_feed_id=feed.id)
+        else:
+            pull = follower_count > FANOUT_EXIT_LIMIT
+            if not pull:
+                # 읽기 시점 조회 동안 쓴 피드를 먼저 팔로워 타임라인에 채운 뒤 팬아웃으로 돌아간다
+                backfill_pull_feeds(pull_author, follower_ids)
+                pull_author.delete()
+
+        if not pull:
+            entries += [TimelineEntry(user_id=follower_id, feed=feed) for follower_id in follower_ids]
+
+        TimelineEntry.objects.bulk_create(entries, batch_size=FANOUT_BATCH_SIZE, ignore_conflicts=True)
+
+def backfill_pull_feeds(pull_author, follower_ids):
+    feeds = Feed.objects.filter(user_id=pull_author.user_id)
+    if pull_author.since_feed_id is not None:
+        feeds = feeds.filter(id__gte=pull_author.since_feed_id)
+    follower_ids = list(follower_ids)
+
+    for feed_id in feeds.values_list('id', flat=True).iterator():
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=follower_id, feed_id=feed_id) for follower_id in follower_ids],
+            batch_size=FANOUT_BATCH_SIZE, ignore_conflicts=True,
+        )
+
+def read_timeline(user_id, cursor=None, size=20):
+    # 미리 채워둔 타임라인과 팔로워가 많은 작성자의 피드를 feed id 내림차순으로 합친다
+    entries = TimelineEntry.objects.filter(user=user_id).order_by('-feed')
+    following = Follow.objects.filter(follower_user=user_id).values('following_user')
+    pulled = Feed.objects.filter(
+        user__in=PullAuthor.objects.filter(user__in=following).values('user')
+    ).order_by('-id')
+
+    if cursor is not None:
+        entries = entries.filter(feed__lt=cursor)
+        pulled = pulled.filter(id__lt=cursor)
+
+    feed_ids = set(entries.values_list('feed', flat=True)[:size + 1])
+    feed_ids.update(pulled.values_list('id', flat=True)[:size + 1])
+    feed_ids = sorted(feed_ids, reverse=True)
+
+    next_cursor = None
+    if len(feed_ids) > size:
+        feed_ids = feed_ids[:size]
+        next_cursor = feed_ids[-1]
+
+    feeds = Feed.objects.in_bulk(feed_ids)
+    return [feeds[feed_id] for feed_id in feed_ids if feed_id in feeds], next_cursor
@@ -10,6 +10,7 @@ from .manda_urls.urls_write import urlpatterns as manda_write_urls
 from .manda_urls.urls_manda import urlpatterns as manda_manda_urls
 from .manda_urls.urls_feed import urlpatterns as manda_feed_urls
 from .manda_urls.urls_chat import urlpatterns as manda_chat_urls
+from .manda_urls.urls_upload import urlpatterns as manda_upload_urls
 
 urlpatterns = [
     path('v1/test/', TestView.as_view(), name='test'),
@@ -19,5 +20,6 @@ urlpatterns = [
     path('manda/', include(manda_manda_urls)), #만다라트
 	path('feed/', include(manda_feed_urls)), #피드
     path('chat/', include(manda_chat_urls)), #채팅
+    path('upload/', include(manda_upload_urls)), #이미지 직접 업로드
     path('get_token/', views.get_csrf_token, name='get_token'), #토큰
 ]
@@ -19,12 +19,13 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 import manda_app.routing 
+from manda_app.middleware import TokenAuthMiddleware
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'manda_project.settings')
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": URLRouter(
+    "websocket": TokenAuthMiddleware(URLRouter(
         manda_app.routing.websocket_urlpatterns,
-    ),
+    )),
 })
@@ -178,6 +178,17 @@ CHANNEL_LAYERS = {
     },
 }
 
+# 캐시 (프로필 / 접속 상태). 기본은 프로세스 로컬 메모리이며 테스트도 이 설정을 사용한다.
+# 여러 프로세스로 배포할 때는 secret.json 에 공유 백엔드를 지정한다
+# 예) "cache_backend": "django.core.cache.backends.memcached.PyMemcacheCache", "cache_location": "127.0.0.1:11211"
+#     "cache_backend": "django.core.cache.backends.db.DatabaseCache", "cache_location": "manda_cache"
+CACHES = {
+    'default': {
+        'BACKEND': secrets.get('cache_backend', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': secrets.get('cache_location', 'manda'),
+    }
+}
+
 # CORS 세팅 추가
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ORIGIN_ALLOW_ALL = True